@@ -0,0 +1,532 @@
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from itertools import repeat
+from more_itertools import pairwise
+import json
+import numpy as np
+import random
+import time
+
+from engine import BOARD_HEIGHT, BOARD_WIDTH, KINDS, SHAPES, Action, Player, Tetromino, column_profile
+
+DANGER_ZONE = ((3, 2), (4, 2), (5, 2), (4, 3))
+DANGER_X, DANGER_Y = np.array(DANGER_ZONE).T
+COLUMN_BITS = 1 << np.arange(BOARD_WIDTH)
+
+Weights = namedtuple('Weights', ['lines', 'bumpiness', 'holes', 'game_over'])
+DEFAULT_WEIGHTS = Weights(40, -2, -30, -2000)
+Placement = namedtuple('Placement', ['rotation', 'x', 'y', 'path'])
+BeamLine = namedtuple('BeamLine', ['moves', 'kinds', 'lines', 'score', 'depth'])
+
+BEAM_WIDTH = 16
+BEAM_DEPTH = 6
+PARALLEL_BEAM = 32
+
+SIDE_MOVES = ((Action.LEFT, 0, -1, 0), (Action.RIGHT, 0, 1, 0), (Action.ROTATE, 1, 0, 0))
+SEARCH_MOVES = SIDE_MOVES + ((Action.DOWN, 0, 0, 1),)
+KEY_NAMES = {Action.LEFT: '<', Action.RIGHT: '>', Action.DOWN: 'v', Action.ROTATE: '^', Action.DROP: '_'}
+
+
+DANGER_MASKS = {y: sum(1 << x for x, zone_y in DANGER_ZONE if zone_y == y) for _, y in DANGER_ZONE}
+
+
+def is_game_over(rows):
+    return any(rows[y] & mask for y, mask in DANGER_MASKS.items())
+
+
+class SearchStats:
+    def __init__(self):
+        self.decisions = 0
+        self.nodes = 0
+        self.elapsed = 0.0
+        self.last_nodes = 0
+        self.last_elapsed = 0.0
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed else 0.0
+
+    def record(self, nodes, elapsed):
+        self.decisions += 1
+        self.nodes += nodes
+        self.elapsed += elapsed
+        self.last_nodes = nodes
+        self.last_elapsed = elapsed
+
+
+class EvaluationCache:
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def load_weights(path):
+    with open(path) as file:
+        data = json.load(file)
+    if 'best' in data:
+        data = data['best']['weights']
+    return Weights(**data)
+
+
+def save_weights(path, weights):
+    with open(path, 'w') as file:
+        json.dump(weights._asdict(), file, indent=2)
+
+
+def board_key(player):
+    tet = player.tetromino
+    return tuple(player.rows), tet.kind, tet.rotation, tet.pos[0], tet.pos[1]
+
+
+class Calculator:
+    def __init__(self, rows, lines_cleared, heights=None, holes=None, weights=DEFAULT_WEIGHTS):
+        self.rows = rows
+        self.lines_cleared = lines_cleared
+        self.weights = weights
+        if heights is None or holes is None:
+            heights, holes = column_profile(rows)
+        self.heights = heights
+        self.holes = holes
+
+    def calculate(self):
+        score = self.weights.lines * self.lines_cleared
+        score += self.weights.bumpiness * self.bumpiness()
+        score += self.weights.holes * self.holes_simple()
+        if self.is_it_game_over():
+            score += self.weights.game_over
+        return score
+
+    def bumpiness(self):
+        column_heights = self.column_heights()
+        result = sum(abs(pair[0] - pair[1]) for pair in pairwise(column_heights))
+        if column_heights[1] > column_heights[0]:
+            result += column_heights[1] - column_heights[0]
+        if column_heights[-2] > column_heights[-1]:
+            result += column_heights[-2] - column_heights[-1]
+        return result
+
+    def holes_simple(self):
+        return sum(self.holes)
+
+    def is_it_game_over(self):
+        return is_game_over(self.rows)
+
+    def column_heights(self):
+        return self.heights
+
+
+def stack_occupancy(boards):
+    rows = np.array(boards, dtype=np.int64).reshape(-1, BOARD_HEIGHT)
+    return (rows[:, :, np.newaxis] & COLUMN_BITS) != 0
+
+
+def evaluate_boards(occupancy, lines_cleared, weights=DEFAULT_WEIGHTS):
+    occupancy = np.asarray(occupancy, dtype=bool)
+    heights = np.where(occupancy.any(axis=1), BOARD_HEIGHT - occupancy.argmax(axis=1), 0)
+    covered = np.logical_or.accumulate(occupancy, axis=1)
+    holes = np.count_nonzero(covered & ~occupancy, axis=(1, 2))
+    game_over = occupancy[:, DANGER_Y, DANGER_X].any(axis=1)
+    return score_profiles(heights, holes, game_over, lines_cleared, weights)
+
+
+def score_profiles(heights, holes, game_over, lines_cleared, weights=DEFAULT_WEIGHTS):
+    heights = np.asarray(heights)
+    bumpiness = np.abs(np.diff(heights, axis=1)).sum(axis=1)
+    bumpiness += np.maximum(heights[:, 1] - heights[:, 0], 0)
+    bumpiness += np.maximum(heights[:, -2] - heights[:, -1], 0)
+    return (weights.lines * np.asarray(lines_cleared) + weights.bumpiness * bumpiness
+            + weights.holes * np.asarray(holes) + weights.game_over * np.asarray(game_over))
+
+
+def search_placements(player, tetromino=None):
+    tet = player.tetromino if tetromino is None else tetromino
+    shapes = SHAPES[tet.kind]
+    fits = player.fits
+    spawn_y = tet.pos[1]
+    start = (tet.rotation, tet.pos[0])
+    if not fits(shapes[start[0]], start[1], spawn_y):
+        return []
+    column_paths = {start: ()}
+    queue = deque([start])
+    while queue:
+        column = queue.popleft()
+        rotation, x = column
+        for action, turn, dx, _ in SIDE_MOVES:
+            target = ((rotation + turn) % 4, x + dx)
+            if target not in column_paths and fits(shapes[target[0]], target[1], spawn_y):
+                column_paths[target] = column_paths[column] + (action,)
+                queue.append(target)
+    landing = {column: spawn_y + player.landing_distance(shapes[column[0]], column[1], spawn_y)
+               for column in column_paths}
+
+    def covered(rotation, x, y):
+        bottom = landing.get((rotation, x))
+        return bottom is not None and y <= bottom
+
+    def descend(column, y):
+        if y == landing[column] and y - spawn_y > 1:
+            return column_paths[column] + (Action.DROP,)
+        return column_paths[column] + (Action.DOWN,) * (y - spawn_y)
+
+    paths = {}
+    queue = deque()
+    for column, bottom in landing.items():
+        rotation, x = column
+        for action, turn, dx, _ in SIDE_MOVES:
+            target = ((rotation + turn) % 4, x + dx)
+            shape = shapes[target[0]]
+            if target[1] + shape.left < 0 or target[1] + shape.right >= BOARD_WIDTH:
+                continue
+            lowest = landing.get(target, spawn_y - 1)
+            for y in range(max(lowest + 1, spawn_y), bottom + 1):
+                state = target + (y,)
+                if state not in paths and fits(shape, target[1], y):
+                    paths[state] = descend(column, y) + (action,)
+                    queue.append(state)
+    while queue:
+        state = queue.popleft()
+        rotation, x, y = state
+        for action, turn, dx, dy in SEARCH_MOVES:
+            target = ((rotation + turn) % 4, x + dx, y + dy)
+            if target not in paths and not covered(*target) and fits(shapes[target[0]], target[1], target[2]):
+                paths[target] = paths[state] + (action,)
+                queue.append(target)
+        distance = player.landing_distance(shapes[rotation], x, y)
+        target = (rotation, x, y + distance)
+        if distance > 1 and target not in paths and not covered(*target):
+            paths[target] = paths[state] + (Action.DROP,)
+            queue.append(target)
+
+    locks = [(column + (bottom,), descend(column, bottom)) for column, bottom in landing.items()]
+    locks += [(state, path) for state, path in paths.items()
+              if not fits(shapes[state[0]], state[1], state[2] + 1)]
+    cells = set()
+    placements = []
+    for (rotation, x, y), path in locks:
+        shape = shapes[rotation]
+        key = tuple((y + dy, mask << (x + shape.left)) for dy, mask in shape.masks)
+        if key not in cells:
+            cells.add(key)
+            placements.append(Placement(rotation, x, y, path))
+    return placements
+
+
+def reachable_placements(player, tetromino=None, cache=None):
+    if cache is None:
+        return search_placements(player, tetromino)
+    tet = player.tetromino if tetromino is None else tetromino
+    key = ('placements', tuple(player.rows), tet.kind, tet.rotation, tet.pos[0], tet.pos[1])
+    entry = cache.get(key)
+    if entry is None:
+        entry = search_placements(player, tet)
+        cache.put(key, entry)
+    return entry
+
+
+def candidate_moves(player, reachable=False, cache=None):
+    if reachable:
+        return reachable_placements(player, cache=cache)
+    return [(rot, sideways) for rot in range(player.tetromino.max_rot) for sideways in range(-4, 6)]
+
+
+def try_move(player, move):
+    if isinstance(move, Placement):
+        return player.try_lock(move.rotation, move.x, move.y)
+    return player.try_place(move)
+
+
+def as_move(move):
+    return move if isinstance(move, Placement) else list(move)
+
+
+def key_path(move):
+    return ' '.join(KEY_NAMES[action] for action in move.path)
+
+
+def hypothetic_settle(player, move):
+    undo = try_move(player, move)
+    if undo is None:
+        return None, 0
+    result = list(player.rows), player.lines_cleared - undo[3]
+    player.undo(undo)
+    return result
+
+
+def score_moves(player, cache=None, weights=DEFAULT_WEIGHTS, reachable=False):
+    if cache is None:
+        return compute_scores(player, weights, reachable)
+    key = ('scores', board_key(player), weights, reachable)
+    entry = cache.get(key)
+    if entry is None:
+        entry = compute_scores(player, weights, reachable, cache)
+        cache.put(key, entry)
+    return entry
+
+
+def compute_scores(player, weights=DEFAULT_WEIGHTS, reachable=False, cache=None):
+    move_list = []
+    heights = []
+    holes = []
+    game_over = []
+    lines_cleared = []
+    for move in candidate_moves(player, reachable, cache):
+        undo = try_move(player, move)
+        if undo is not None:
+            move_list.append(move)
+            heights.append(tuple(player.heights))
+            holes.append(sum(player.holes))
+            game_over.append(is_game_over(player.rows))
+            lines_cleared.append(player.lines_cleared - undo[3])
+            player.undo(undo)
+    if not move_list:
+        return move_list, np.zeros(0, dtype=np.int64)
+    return move_list, score_profiles(heights, holes, game_over, lines_cleared, weights)
+
+
+def find_initial_moves(player, count=4, cache=None, weights=DEFAULT_WEIGHTS, reachable=False):
+    move_list, scores = score_moves(player, cache, weights, reachable)
+    return [move_list[i] for i in np.argsort(-scores, kind='stable')[:count]]
+
+
+def find_best_move(player, cache=None, weights=DEFAULT_WEIGHTS, reachable=False):
+    move_list, scores = score_moves(player, cache, weights, reachable)
+    if not move_list:
+        return [0, 0]
+    return as_move(move_list[scores.argmax()])
+
+
+def find_lookahead_move(player, next_tetromino, count=4, time_budget=0.02, stats=None, cache=None,
+                        weights=DEFAULT_WEIGHTS, reachable=False):
+    start = time.perf_counter()
+    key = ('lookahead', board_key(player), next_tetromino.kind, count, weights, reachable)
+    best_move = cache.get(key) if cache is not None else None
+    if best_move is not None:
+        if stats is not None:
+            stats.record(0, time.perf_counter() - start)
+        return as_move(best_move)
+    move_list, scores = score_moves(player, cache, weights, reachable)
+    nodes = len(move_list)
+    best_move = [0, 0]
+    complete = True
+    if move_list:
+        order = np.argsort(-scores, kind='stable')
+        best_move = as_move(move_list[order[0]])
+        best_score = None
+        for i in order[:count]:
+            if time.perf_counter() - start > time_budget:
+                complete = False
+                break
+            undo = try_move(player, move_list[i])
+            current = player.tetromino
+            player.tetromino = next_tetromino
+            next_moves, next_scores = score_moves(player, cache, weights, reachable)
+            player.tetromino = current
+            lines = player.lines_cleared - undo[3]
+            player.undo(undo)
+            nodes += len(next_moves)
+            if next_moves:
+                score = next_scores.max() + weights.lines * lines
+            else:
+                score = scores[i] + weights.game_over
+            if best_score is None or score > best_score:
+                best_move = as_move(move_list[i])
+                best_score = score
+    if cache is not None and complete:
+        cache.put(key, best_move if isinstance(best_move, Placement) else tuple(best_move))
+    if stats is not None:
+        stats.record(nodes, time.perf_counter() - start)
+    return best_move
+
+
+def expand_player(player, reachable=False):
+    children = []
+    tet = player.tetromino
+    if not player.fits(tet.shape, tet.pos[0], tet.pos[1]):
+        return children
+    for move in candidate_moves(player, reachable):
+        undo = try_move(player, move)
+        if undo is not None:
+            children.append((move, tuple(player.rows), tuple(player.heights), sum(player.holes),
+                             player.lines_cleared - undo[3], is_game_over(player.rows)))
+            player.undo(undo)
+    return children
+
+
+def expand_beam(boards, kind, reachable=False):
+    player = Player(Tetromino(kind))
+    children = []
+    for index, rows in enumerate(boards):
+        player.rows = list(rows)
+        player.heights, player.holes = column_profile(player.rows)
+        player.tetromino = Tetromino(kind)
+        children += [(index,) + child for child in expand_player(player, reachable)]
+    return children
+
+
+def expand_level(boards, kind, reachable=False, executor=None, processes=1):
+    if executor is None or len(boards) < PARALLEL_BEAM:
+        return expand_beam(boards, kind, reachable)
+    size = -(-len(boards) // processes)
+    offsets = range(0, len(boards), size)
+    chunks = [boards[offset:offset + size] for offset in offsets]
+    children = []
+    for offset, chunk in zip(offsets, executor.map(expand_beam, chunks, repeat(kind), repeat(reachable))):
+        children += [(child[0] + offset,) + child[1:] for child in chunk]
+    return children
+
+
+def search_beam(player, kinds, width=BEAM_WIDTH, depth=BEAM_DEPTH, time_budget=0.1, stats=None,
+                weights=DEFAULT_WEIGHTS, reachable=False, executor=None, processes=1, seed=None):
+    start = time.perf_counter()
+    sampler = random.Random(seed)
+    kinds = tuple(kinds[:depth]) + tuple(sampler.choice(KINDS) for _ in range(depth - len(kinds)))
+    beam = [((), 0, ())]
+    nodes = 0
+    best = None
+    for level, kind in enumerate(kinds):
+        if not level:
+            children = [(0,) + child for child in expand_player(player, reachable)]
+        elif time.perf_counter() - start > time_budget:
+            break
+        else:
+            children = expand_level([rows for rows, _, _ in beam], kind, reachable, executor, processes)
+        nodes += len(children)
+        if not children:
+            break
+        lines = [beam[child[0]][1] + child[5] for child in children]
+        scores = score_profiles([child[3] for child in children], [child[4] for child in children],
+                                [child[6] for child in children], lines, weights)
+        order = np.argsort(-scores, kind='stable')
+        first = children[order[0]]
+        best = BeamLine(beam[first[0]][2] + (first[1],), kinds[:level + 1], lines[order[0]], float(scores[order[0]]),
+                        level + 1)
+        next_beam = []
+        seen = set()
+        for i in order:
+            index, move, rows, _, _, _, game_over = children[i]
+            if game_over or rows in seen:
+                continue
+            seen.add(rows)
+            next_beam.append((rows, lines[i], beam[index][2] + (move,)))
+            if len(next_beam) == width:
+                break
+        if not next_beam:
+            break
+        beam = next_beam
+    if stats is not None:
+        stats.record(nodes, time.perf_counter() - start)
+    return best
+
+
+def find_beam_move(player, kinds, width=BEAM_WIDTH, depth=BEAM_DEPTH, time_budget=0.1, stats=None,
+                   weights=DEFAULT_WEIGHTS, reachable=False, executor=None, processes=1, seed=None):
+    line = search_beam(player, kinds, width, depth, time_budget, stats, weights, reachable, executor, processes,
+                       seed)
+    if line is None:
+        return [0, 0], line
+    return as_move(line.moves[0]), line
+
+
+def fit_clue_tetromino(player, move):
+    if isinstance(move, Placement):
+        return Tetromino(player.tetromino.kind, move.rotation, (move.x, move.y), 'cc')
+    tet = Tetromino(player.tetromino.kind, color='cc')
+    tet.rotate(times=move[0])
+    tet.move_right(times=move[1])
+    tet.move_down(player.drop_distance(tet))
+    return tet
+
+
+worker_cache = None
+
+
+def init_worker_cache(capacity):
+    global worker_cache
+    worker_cache = EvaluationCache(capacity) if capacity else None
+
+
+def search_hint(snapshot, next_kind, lookahead=True, time_budget=0.02, cache=None, weights=DEFAULT_WEIGHTS,
+                reachable=False, beam=None):
+    if cache is None:
+        cache = worker_cache
+    player = Player.from_snapshot(snapshot)
+    next_tetromino = Tetromino(next_kind)
+    stats = SearchStats()
+    line = None
+    if beam is not None:
+        width, depth, budget = beam
+        move, line = find_beam_move(player, (player.tetromino.kind, next_kind), width, depth, budget, stats, weights,
+                                    reachable)
+    elif lookahead:
+        move = find_lookahead_move(player, next_tetromino, time_budget=time_budget, stats=stats, cache=cache,
+                                   weights=weights, reachable=reachable)
+    else:
+        start = time.perf_counter()
+        move = find_best_move(player, cache, weights, reachable)
+        stats.record(0, time.perf_counter() - start)
+    return move, stats.last_nodes, stats.last_elapsed, line
+
+
+class HintWorker:
+    def __init__(self, processes=False, cache_size=0):
+        if processes:
+            self.executor = ProcessPoolExecutor(1, initializer=init_worker_cache, initargs=(cache_size,))
+            self.cache = None
+        else:
+            self.executor = ThreadPoolExecutor(1)
+            self.cache = EvaluationCache(cache_size) if cache_size else None
+        self.future = None
+        self.token = 0
+
+    def submit(self, player, next_tetromino, lookahead=True, time_budget=0.02, weights=DEFAULT_WEIGHTS,
+               reachable=False, beam=None):
+        if self.future is not None:
+            self.future.cancel()
+        self.token += 1
+        self.future = self.executor.submit(search_hint, player.snapshot(block_grid=False), next_tetromino.kind,
+                                           lookahead, time_budget, self.cache, weights, reachable, beam)
+        self.future.token = self.token
+        return self.token
+
+    def poll(self):
+        future = self.future
+        if future is None or not future.done() or future.cancelled():
+            return None
+        self.future = None
+        if future.token != self.token:
+            return None
+        return future.result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
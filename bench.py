@@ -0,0 +1,293 @@
+from argparse import ArgumentParser
+from functools import lru_cache
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from engine import (BOARD_HEIGHT, BOARD_WIDTH, EMPTY, FULL_ROW, KINDS, Action, Player, Settings,
+                    Tetromino, column_profile)
+import ai
+
+CORPUS = {
+    'empty': (0,) * BOARD_HEIGHT,
+    'midgame': (0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 67, 867, 483, 1007, 1019, 767, 1022),
+    'near_topout': (0, 0, 0, 0, 16, 48, 48, 112, 120, 124, 120, 244, 1020, 943, 894, 1015, 507, 1019, 767, 1022)
+}
+PIECE = 'T'
+MIN_TIME = 0.2
+REPEAT = 7
+REFERENCE_NUMBER = 20
+STARTUP_MODULES = ('engine', 'ai', 'main')
+IMPORT_SCRIPT = 'import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)'
+FIRST_FRAME_SCRIPT = '''
+import time
+start = time.perf_counter()
+import main
+game = main.Game(main.start_display(), main.Settings())
+game.present()
+print(time.perf_counter() - start)
+'''
+
+
+@lru_cache(maxsize=None)
+def block_grid(rows):
+    grid = np.full((BOARD_HEIGHT, BOARD_WIDTH), EMPTY, dtype=np.uint8)
+    for y, row in enumerate(rows):
+        for x in range(BOARD_WIDTH):
+            if row >> x & 1:
+                grid[y, x] = 1 + (x + y) % (len(KINDS))
+    return grid
+
+
+def make_player(rows, kind=PIECE):
+    return Player(Tetromino(kind), rows, block_grid(rows))
+
+
+def with_full_rows(rows, count=2):
+    return tuple(rows[:BOARD_HEIGHT - count]) + (FULL_ROW,) * count
+
+
+def reference():
+    start = time.perf_counter()
+    for _ in range(REFERENCE_NUMBER):
+        sorted(str(i * i) for i in range(1000))
+    return (time.perf_counter() - start) / REFERENCE_NUMBER
+
+
+def timing_result(timings, references, number):
+    return {'best_us': min(timings) * 1e6, 'median_us': float(np.median(timings)) * 1e6,
+            'worst_us': max(timings) * 1e6, 'reference_us': float(np.median(references)) * 1e6, 'number': number,
+            'repeat': len(timings)}
+
+
+def measure(setup, operation, repeat):
+    number = 1
+    while True:
+        subjects = [setup() for _ in range(number)]
+        start = time.perf_counter()
+        for subject in subjects:
+            operation(subject)
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_TIME or number >= 1 << 20:
+            break
+        number *= 2
+    timings = [elapsed / number]
+    references = [reference()]
+    for _ in range(repeat - 1):
+        subjects = [setup() for _ in range(number)]
+        start = time.perf_counter()
+        for subject in subjects:
+            operation(subject)
+        timings.append((time.perf_counter() - start) / number)
+        references.append(reference())
+    return timing_result(timings, references, number)
+
+
+def valid_moves(player):
+    for rot in range(4):
+        for adj_x in range(-5, 6):
+            player.is_valid_move(adj_x, 0, rot)
+
+
+def dropped(rows):
+    player = make_player(rows)
+    player.tetromino.move_down(player.drop_distance())
+    return player
+
+
+def corpus_boards():
+    boards = list(CORPUS.values()) + [with_full_rows(rows) for rows in CORPUS.values()]
+    lines = list(range(len(boards)))
+    return boards, lines
+
+
+def check_evaluators():
+    boards, lines = corpus_boards()
+    batch = ai.evaluate_boards(ai.stack_occupancy(boards), lines)
+    single = [ai.Calculator(list(rows), count).calculate() for rows, count in zip(boards, lines)]
+    if batch.tolist() != single:
+        raise SystemExit(f'evaluate_boards {batch.tolist()} does not match Calculator.calculate {single}')
+
+
+def shared(subject):
+    return lambda: subject
+
+
+def engine_benchmarks(name, rows):
+    cleared_rows = with_full_rows(rows)
+    player = make_player(rows)
+    return {
+        f'is_valid_move/{name}': (shared(player), valid_moves),
+        f'hard_drop/{name}': (lambda: make_player(rows), lambda player: player.apply(Action.DROP)),
+        f'blend_tetromino/{name}': (lambda: dropped(rows), Player.blend_tetromino),
+        f'clear_lines/{name}': (lambda: make_player(cleared_rows), Player.clear_lines),
+        f'calculate/{name}': (shared(ai.Calculator(list(rows), 0)), ai.Calculator.calculate),
+        f'find_best_move/{name}': (shared(player), ai.find_best_move),
+        f'search_placements/{name}': (shared(player), ai.search_placements),
+        f'find_best_move_reachable/{name}': (shared(player),
+                                             lambda player: ai.find_best_move(player, reachable=True)),
+        f'find_lookahead_move/{name}': (
+            shared(player), lambda player: ai.find_lookahead_move(player, Tetromino('I'), time_budget=float('inf'))),
+        f'search_beam/{name}': (shared(player),
+                                lambda player: ai.search_beam(player, (PIECE, 'I'), time_budget=float('inf'), seed=0))
+    }
+
+
+def draw_benchmarks(name, rows):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    import main
+
+    surface = pygame.Surface(main.MAP_SIZE)
+    game = main.Game(surface, Settings())
+    player = game.player
+    player.rows = list(rows)
+    player.block_grid = block_grid(rows).copy()
+    player.heights, player.holes = column_profile(player.rows)
+    game.next_tetromino = Tetromino(PIECE)
+
+    def lock_frame(_):
+        player.board_version += 1
+        game.invalidate()
+        game.draw()
+
+    def move_frame(_):
+        player.tetromino.move_right(1 if player.tetromino.pos[0] < 4 else -1)
+        game.draw()
+
+    return {
+        f'draw_lock_frame/{name}': (lambda: None, lock_frame),
+        f'draw_move_frame/{name}': (lambda: None, move_frame)
+    }
+
+
+def spectator_benchmarks(count=64):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    import spectator
+
+    viewer = spectator.Spectator(count)
+    viewer.attach(pygame.Surface(viewer.size))
+    for _ in range(240):
+        viewer.step()
+    return {f'spectator_frame/{count}': (lambda: None, lambda _: viewer.render())}
+
+
+def run_script(script):
+    environment = dict(os.environ, SDL_VIDEODRIVER='dummy', PYGAME_HIDE_SUPPORT_PROMPT='1')
+    output = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env=environment, capture_output=True, text=True, check=True).stdout
+    return float(output.split()[-1])
+
+
+def measure_script(script, repeat):
+    timings, references = [], []
+    for _ in range(repeat):
+        timings.append(run_script(script))
+        references.append(reference())
+    return timing_result(timings, references, 1)
+
+
+def startup_benchmarks(draw=True):
+    scripts = {f'startup/import_{module}': IMPORT_SCRIPT.format(module=module) for module in STARTUP_MODULES}
+    if draw:
+        scripts['startup/first_frame'] = FIRST_FRAME_SCRIPT
+    return scripts
+
+
+def benchmarks(draw=True):
+    boards, lines = corpus_boards()
+    result = {
+        'evaluate_boards/corpus': (lambda: None, lambda _: ai.evaluate_boards(ai.stack_occupancy(boards), lines)),
+        'calculate/corpus': (lambda: None, lambda _: [ai.Calculator(list(rows), count).calculate()
+                                                      for rows, count in zip(boards, lines)])
+    }
+    for name, rows in CORPUS.items():
+        result.update(engine_benchmarks(name, rows))
+        if draw:
+            result.update(draw_benchmarks(name, rows))
+    if draw:
+        result.update(spectator_benchmarks())
+    return result
+
+
+def run(selected=None, repeat=REPEAT, draw=True):
+    results = {}
+    for name, (setup, operation) in benchmarks(draw).items():
+        if selected and not any(pattern in name for pattern in selected):
+            continue
+        results[name] = measure(setup, operation, repeat)
+        print(f"{name:34} {results[name]['median_us']:12.2f} us")
+    for name, script in startup_benchmarks(draw).items():
+        if selected and not any(pattern in name for pattern in selected):
+            continue
+        results[name] = measure_script(script, repeat)
+        print(f"{name:34} {results[name]['median_us']:12.2f} us")
+    return {
+        'meta': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S')
+        },
+        'results': results
+    }
+
+
+def compare(baseline, current, threshold):
+    regressions = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:34} {'new':>12}")
+            continue
+        scale = before['reference_us'] / result['reference_us'] if 'reference_us' in before else 1
+        ratio = result['median_us'] * scale / before['median_us']
+        regressed = ratio > 1 + threshold and result['best_us'] * scale > before.get('worst_us', before['median_us'])
+        if regressed:
+            regressions.append(name)
+        print(f"{name:34} {before['median_us']:10.2f} -> {result['median_us']:10.2f} us  {ratio:6.2f}x"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark engine, search and rendering hot paths on a fixed board corpus.')
+    parser.add_argument('--save', help='write the results to this JSON baseline')
+    parser.add_argument('--compare', help='compare against this JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='allowed slowdown of the median before flagging, 0.1 = 10%%; the fastest run must '
+                             'also be slower than the slowest baseline run, both scaled by the reference loop')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--filter', action='append', help='only run benchmarks whose name contains this')
+    parser.add_argument('--no-draw', action='store_true', help='skip the pygame rendering benchmarks')
+    args = parser.parse_args()
+
+    check_evaluators()
+    current = run(args.filter, args.repeat, not args.no_draw)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(current, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"\ncompared with {args.compare} ({baseline['meta']['created']}), threshold {args.threshold:.0%}, "
+              f"ratios scaled by the reference loop")
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"\nmeasuring {len(regressions)} flagged benchmark(s) again")
+            rerun = run(regressions, args.repeat, not args.no_draw)
+            rerun['results'] = {name: rerun['results'][name] for name in regressions}
+            regressions = [name for name in compare(baseline, rerun, args.threshold) if name in regressions]
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
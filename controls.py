@@ -0,0 +1,84 @@
+import csv
+
+import numpy as np
+
+from engine import BOARD_HEIGHT, Action
+
+REPEATING = frozenset((Action.LEFT, Action.RIGHT, Action.DOWN))
+MIN_ARR = 0.001
+MAX_REPEATS = BOARD_HEIGHT
+
+
+class KeyRepeater:
+    def __init__(self, controls, das=0.167, arr=0.033, catch_up=8 / 60):
+        self.controls = controls
+        self.das = das
+        self.arr = max(arr, MIN_ARR)
+        self.catch_up = catch_up
+        self.held = {}
+
+    def press(self, key, now):
+        action = self.controls.get(key)
+        if action in REPEATING:
+            self.held[key] = now + self.das
+        return action
+
+    def release(self, key):
+        self.held.pop(key, None)
+
+    def reset(self, now):
+        for key in self.held:
+            self.held[key] = now + self.das
+
+    def next_due(self):
+        return min(self.held.values(), default=float('inf'))
+
+    def repeats(self, now, pressed):
+        actions = []
+        for key, due in list(self.held.items()):
+            if not pressed(key):
+                del self.held[key]
+                continue
+            due = max(due, now - self.catch_up)
+            count = 0
+            while due <= now and count < MAX_REPEATS:
+                actions.append((self.controls[key], due))
+                due += self.arr
+                count += 1
+            self.held[key] = max(due, now) if count == MAX_REPEATS else due
+        actions.sort(key=lambda pair: pair[1])
+        return actions
+
+
+class LatencyLog:
+    def __init__(self):
+        self.entries = []
+        self.pending = []
+
+    def record(self, action, left, repeat, source, applied):
+        entry = [action.name, int(left), int(repeat), source, applied, None]
+        self.entries.append(entry)
+        self.pending.append(entry)
+
+    def displayed(self, now):
+        for entry in self.pending:
+            entry[5] = now
+        self.pending = []
+
+    def summary(self):
+        applied = np.array([entry[4] - entry[3] for entry in self.entries]) * 1000
+        displayed = np.array([entry[5] - entry[3] for entry in self.entries if entry[5] is not None]) * 1000
+        return {
+            'inputs': len(self.entries),
+            'applied_ms': {f'p{p}': float(np.percentile(applied, p)) if len(applied) else 0.0 for p in (50, 95, 99)},
+            'displayed_ms': {f'p{p}': float(np.percentile(displayed, p)) if len(displayed) else 0.0
+                             for p in (50, 95, 99)}
+        }
+
+    def dump(self, path):
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(('action', 'left', 'repeat', 'applied_ms', 'displayed_ms'))
+            for action, left, repeat, source, applied, displayed in self.entries:
+                writer.writerow((action, left, repeat, f'{(applied - source) * 1000:.3f}',
+                                 '' if displayed is None else f'{(displayed - source) * 1000:.3f}'))
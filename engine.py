@@ -0,0 +1,532 @@
+from enum import Enum
+
+from collections import namedtuple
+import numpy as np
+import random
+
+BOARD_HEIGHT = 20
+BOARD_WIDTH = 10
+FULL_ROW = (1 << BOARD_WIDTH) - 1
+FALLING_SPEED = (40, 28, 24, 21, 18, 15, 13, 12, 11, 10, 10, 10, 10, 10, 10, 10, 10)
+
+COLOR_NAMES = ('white', 'ye', 'bl', 're', 'gr', 'or', 'pi', 'aq', 'cc')
+COLOR_INDEX = {name: index for index, name in enumerate(COLOR_NAMES)}
+EMPTY = COLOR_INDEX['white']
+
+
+class Difficulty(Enum):
+    EASY = 0
+    MEDIUM = 1
+    HARD = 2
+
+
+class Settings:
+    def __init__(self):
+        self.game_version = 1
+        self.difficulty = Difficulty.MEDIUM
+        self.hint_lookahead = True
+        self.hint_time_budget = 0.02
+        self.hint_cache_size = 65536
+        self.hint_async = True
+        self.hint_processes = False
+        self.hint_weights = None
+        self.hint_reachable = True
+        self.hint_beam = False
+        self.hint_beam_width = 16
+        self.hint_beam_depth = 6
+        self.hint_beam_budget = 0.1
+        self.seed = None
+        self.seven_bag = False
+        self.record_path = None
+        self.recorded_games = 0
+        self.profile_path = None
+        self.profile_overlay = False
+        self.tick_rate = 60
+        self.render_cap = 60
+        self.das = 0.167
+        self.arr = 0.033
+        self.latency_path = None
+
+
+class Action(Enum):
+    LEFT = 0
+    RIGHT = 1
+    DOWN = 2
+    ROTATE = 3
+    DROP = 4
+
+
+PIECES = {
+    'S': ('re', (4, 1), ((-1, 0), (0, 0), (0, -1), (1, -1)), 2),
+    'Z': ('gr', (4, 1), ((-1, -1), (0, -1), (0, 0), (1, 0)), 2),
+    'J': ('pi', (4, 1), ((0, -1), (0, 0), (0, 1), (-1, 1)), 4),
+    'L': ('or', (4, 1), ((0, -1), (0, 0), (0, 1), (1, 1)), 4),
+    'I': ('bl', (4, 2), ((0, -2), (0, -1), (0, 0), (0, 1)), 2),
+    'O': ('ye', (4, 0), ((0, 0), (1, 0), (0, 1), (1, 1)), 1),
+    'T': ('aq', (4, 1), ((-1, 0), (0, 0), (1, 0), (0, -1)), 4)
+}
+KINDS = tuple(PIECES)
+
+Shape = namedtuple('Shape', ['squares', 'left', 'right', 'masks', 'columns'])
+PlayerSnapshot = namedtuple('PlayerSnapshot', ['rows', 'block_grid', 'tetromino', 'color', 'lines_cleared', 'heights',
+                                               'holes'])
+SimulationSnapshot = namedtuple('SimulationSnapshot', ['players', 'exists', 'next_kind', 'count', 'game_over',
+                                                       'pieces'])
+
+
+def build_shape(squares):
+    left = min(x for x, _ in squares)
+    right = max(x for x, _ in squares)
+    masks = {}
+    for x, y in squares:
+        masks[y] = masks.get(y, 0) | 1 << (x - left)
+    columns = []
+    for column in range(left, right + 1):
+        ys = [y for x, y in squares if x == column]
+        columns.append((column, min(ys), max(ys), len(ys)))
+    return Shape(squares, left, right, tuple(sorted(masks.items())), tuple(columns))
+
+
+def build_rotations(squares, max_rotation):
+    shapes = []
+    for _ in range(4):
+        shapes.append(build_shape(squares))
+        if max_rotation > 1:
+            squares = tuple((-y, x) for x, y in squares)
+    return tuple(shapes)
+
+
+SHAPES = {kind: build_rotations(squares, max_rot) for kind, (_, _, squares, max_rot) in PIECES.items()}
+
+
+def column_profile(rows):
+    heights = [0] * BOARD_WIDTH
+    holes = [0] * BOARD_WIDTH
+    covered = 0
+    for y, row in enumerate(rows):
+        new = row & ~covered
+        while new:
+            lowest = new & -new
+            heights[lowest.bit_length() - 1] = BOARD_HEIGHT - y
+            new ^= lowest
+        gaps = covered & ~row
+        while gaps:
+            lowest = gaps & -gaps
+            holes[lowest.bit_length() - 1] += 1
+            gaps ^= lowest
+        covered |= row
+    return heights, holes
+
+
+class Tetromino:
+    def __init__(self, kind, rotation=0, position=None, color=None):
+        self.kind = kind
+        self.rotation = rotation
+        self.pos = list(PIECES[kind][1] if position is None else position)
+        self.color = PIECES[kind][0] if color is None else color
+
+    @property
+    def shape(self):
+        return SHAPES[self.kind][self.rotation]
+
+    @property
+    def squares(self):
+        return self.shape.squares
+
+    @property
+    def state(self):
+        return self.kind, self.rotation, self.pos[0], self.pos[1]
+
+    @property
+    def max_rot(self):
+        return PIECES[self.kind][3]
+
+    def copy(self):
+        return Tetromino(self.kind, self.rotation, self.pos, self.color)
+
+    def rotate(self, times=1):
+        self.rotation = (self.rotation + times) % 4
+
+    def move_down(self, times=1):
+        self.pos[1] += times
+
+    def move_right(self, times=1):
+        self.pos[0] += times
+
+
+class Player:
+    def __init__(self, tetromino, rows=None, block_grid=None):
+        self.rows = [0] * BOARD_HEIGHT if rows is None else list(rows)
+        if block_grid is None:
+            self.block_grid = np.full((BOARD_HEIGHT, BOARD_WIDTH), EMPTY, dtype=np.uint8)
+        else:
+            self.block_grid = np.array(block_grid, dtype=np.uint8)
+        self.tetromino = tetromino.copy()
+        self.lines_cleared = 0
+        self.board_version = 0
+        self.heights, self.holes = column_profile(self.rows)
+
+    def is_valid_move(self, adj_x=0, adj_y=0, rot=0):
+        tet = self.tetromino
+        shape = SHAPES[tet.kind][(tet.rotation + rot) % 4]
+        return self.fits(shape, tet.pos[0] + adj_x, tet.pos[1] + adj_y)
+
+    def fits(self, shape, x, y):
+        offset = x + shape.left
+        if offset < 0 or x + shape.right > BOARD_WIDTH - 1:
+            return False
+        for dy, mask in shape.masks:
+            row = y + dy
+            if row < 0 or row > BOARD_HEIGHT - 1 or self.rows[row] & mask << offset:
+                return False
+        return True
+
+    def drop_distance(self, tetromino=None):
+        tet = self.tetromino if tetromino is None else tetromino
+        return self.landing_distance(tet.shape, tet.pos[0], tet.pos[1])
+
+    def landing_distance(self, shape, x, y):
+        distance = BOARD_HEIGHT
+        for dx, _, bottom, _ in shape.columns:
+            surface = BOARD_HEIGHT - self.heights[x + dx]
+            if y + bottom >= surface:
+                return self.scan_drop_distance(shape, x, y)
+            distance = min(distance, surface - (y + bottom) - 1)
+        return distance
+
+    def scan_drop_distance(self, shape, x, y):
+        distance = 0
+        while self.fits(shape, x, y + distance + 1):
+            distance += 1
+        return distance
+
+    def blend_tetromino(self):
+        tet = self.tetromino
+        x, y = tet.pos
+        color = COLOR_INDEX[tet.color]
+        for dx, dy in tet.squares:
+            self.block_grid[y + dy, x + dx] = color
+        self.blend_rows()
+        self.board_version += 1
+
+    def blend_rows(self):
+        tet = self.tetromino
+        x, y = tet.pos
+        for dx, dy in tet.squares:
+            self.rows[y + dy] |= 1 << (x + dx)
+        for dx, top, bottom, count in tet.shape.columns:
+            column = x + dx
+            surface = BOARD_HEIGHT - self.heights[column]
+            if y + bottom < surface:
+                self.holes[column] += surface - (y + bottom) - 1
+                self.heights[column] = BOARD_HEIGHT - (y + top)
+            else:
+                self.holes[column] -= count
+
+    def clear_lines(self):
+        cleared = self.clear_rows(self.block_grid)
+        if cleared:
+            self.board_version += 1
+        return cleared
+
+    def clear_rows(self, block_grid=None):
+        if FULL_ROW not in self.rows:
+            return ()
+        cleared = tuple(y for y, row in enumerate(self.rows) if row == FULL_ROW)
+        rows = self.rows
+        write = BOARD_HEIGHT - 1
+        for read in range(BOARD_HEIGHT - 1, -1, -1):
+            row = rows[read]
+            if row == FULL_ROW:
+                continue
+            if write != read:
+                rows[write] = row
+                if block_grid is not None:
+                    block_grid[write] = block_grid[read]
+            write -= 1
+        for y in range(write + 1):
+            rows[y] = 0
+        if block_grid is not None:
+            block_grid[:write + 1] = EMPTY
+        self.lines_cleared += len(cleared)
+        for column in range(BOARD_WIDTH):
+            if BOARD_HEIGHT - self.heights[column] in cleared:
+                self.rescan_column(column)
+            else:
+                self.heights[column] -= len(cleared)
+        return cleared
+
+    def rescan_column(self, column):
+        bit = 1 << column
+        height = 0
+        holes = 0
+        for y, row in enumerate(self.rows):
+            if row & bit:
+                if not height:
+                    height = BOARD_HEIGHT - y
+            elif height:
+                holes += 1
+        self.heights[column] = height
+        self.holes[column] = holes
+
+    def try_place(self, move):
+        tet = self.tetromino
+        rotation = tet.rotation
+        x, y = tet.pos
+        if not self.fits(SHAPES[tet.kind][(rotation + move[0]) % 4], x + move[1], y):
+            return None
+        undo = (tuple(self.rows), tuple(self.heights), tuple(self.holes), self.lines_cleared, rotation, x, y)
+        tet.rotate(move[0])
+        tet.move_right(move[1])
+        tet.move_down(self.drop_distance())
+        self.blend_rows()
+        self.clear_rows()
+        return undo
+
+    def try_lock(self, rotation, x, y):
+        tet = self.tetromino
+        undo = (tuple(self.rows), tuple(self.heights), tuple(self.holes), self.lines_cleared, tet.rotation, tet.pos[0],
+                tet.pos[1])
+        tet.rotation = rotation
+        tet.pos[0] = x
+        tet.pos[1] = y
+        self.blend_rows()
+        self.clear_rows()
+        return undo
+
+    def undo(self, undo):
+        rows, heights, holes, self.lines_cleared, rotation, x, y = undo
+        self.rows[:] = rows
+        self.heights[:] = heights
+        self.holes[:] = holes
+        tet = self.tetromino
+        tet.rotation = rotation
+        tet.pos[0] = x
+        tet.pos[1] = y
+
+    def snapshot(self, block_grid=True):
+        tet = self.tetromino
+        return PlayerSnapshot(tuple(self.rows), self.block_grid.tobytes() if block_grid else None, tet.state,
+                              tet.color, self.lines_cleared, tuple(self.heights), tuple(self.holes))
+
+    def restore(self, snapshot):
+        self.rows[:] = snapshot.rows
+        if snapshot.block_grid is None:
+            self.block_grid[:] = EMPTY
+        else:
+            self.block_grid[:] = np.frombuffer(snapshot.block_grid, np.uint8).reshape(BOARD_HEIGHT, BOARD_WIDTH)
+        kind, rotation, x, y = snapshot.tetromino
+        self.tetromino = Tetromino(kind, rotation, (x, y), snapshot.color)
+        self.lines_cleared = snapshot.lines_cleared
+        self.heights[:] = snapshot.heights
+        self.holes[:] = snapshot.holes
+        self.board_version += 1
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        player = cls(Tetromino(snapshot.tetromino[0]))
+        player.restore(snapshot)
+        return player
+
+    def apply(self, action):
+        if action is Action.RIGHT:
+            if self.is_valid_move(adj_x=1):
+                self.tetromino.move_right()
+        if action is Action.LEFT:
+            if self.is_valid_move(adj_x=-1):
+                self.tetromino.move_right(-1)
+        if action is Action.DOWN:
+            if self.is_valid_move(adj_y=1):
+                self.tetromino.move_down()
+        if action is Action.ROTATE:
+            if self.is_valid_move(rot=1):
+                self.tetromino.rotate()
+        if action is Action.DROP:
+            self.tetromino.move_down(self.drop_distance())
+
+
+class PieceGenerator:
+    def __init__(self, seed, seven_bag=False):
+        self.random = random.Random(seed)
+        self.seven_bag = seven_bag
+        self.bag = []
+
+    def next_kind(self):
+        if not self.seven_bag:
+            return self.random.choice(KINDS)
+        if not self.bag:
+            self.bag = list(KINDS)
+            self.random.shuffle(self.bag)
+        return self.bag.pop()
+
+    def state(self):
+        return self.random.getstate(), tuple(self.bag)
+
+    def set_state(self, state):
+        random_state, bag = state
+        self.random.setstate(random_state)
+        self.bag = list(bag)
+
+
+class Simulation:
+    def __init__(self, settings=None, seed=None):
+        self.settings = Settings() if settings is None else settings
+        self.difficulty = self.settings.difficulty.value
+        if seed is None:
+            seed = self.settings.seed
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.pieces = PieceGenerator(self.seed, self.settings.seven_bag)
+        self.recorder = None
+        self.player = self.create_player(self.generate_tetromino())
+        self.next_tetromino = self.generate_tetromino()
+        self.game_over = False
+        self.count = 1
+
+    @property
+    def level(self):
+        level = self.player.lines_cleared // 10 + 1
+        if level > 11:
+            return 11
+        else:
+            return level
+
+    @property
+    def gravity_interval(self):
+        return FALLING_SPEED[self.difficulty + self.level - 1]
+
+    @staticmethod
+    def create_player(tetromino):
+        return Player(tetromino)
+
+    def generate_tetromino(self):
+        return Tetromino(self.pieces.next_kind())
+
+    def tick(self):
+        if self.count % self.gravity_interval == 0:
+            if self.player.is_valid_move(adj_y=1):
+                self.player.tetromino.move_down()
+            else:
+                self.lock()
+        self.count += 1
+
+    def step(self, action):
+        if self.recorder is not None:
+            self.recorder.record(self.count, action)
+        self.player.apply(action)
+
+    def place(self, move):
+        tet = self.player.tetromino
+        tet.rotate(move[0])
+        tet.move_right(move[1])
+        tet.move_down(self.player.drop_distance())
+        self.lock()
+
+    def upcoming_kinds(self, count):
+        state = self.pieces.state()
+        kinds = [self.pieces.next_kind() for _ in range(count)]
+        self.pieces.set_state(state)
+        return kinds
+
+    def play(self, path):
+        for action in path:
+            self.player.apply(action)
+        self.lock()
+
+    def lock(self):
+        self.player.blend_tetromino()
+        self.clear_lines(self.player)
+        self.replace_tetromino()
+        if not self.player.is_valid_move():
+            self.game_over = True
+
+    def clear_lines(self, player):
+        return player.clear_lines()
+
+    def snapshot(self):
+        return SimulationSnapshot((self.player.snapshot(),), (), self.next_tetromino.kind, self.count, self.game_over,
+                                  self.pieces.state())
+
+    def restore(self, snapshot):
+        self.player.restore(snapshot.players[0])
+        self.next_tetromino = Tetromino(snapshot.next_kind)
+        self.count = snapshot.count
+        self.game_over = snapshot.game_over
+        self.pieces.set_state(snapshot.pieces)
+
+    def replace_tetromino(self):
+        self.player.tetromino = self.next_tetromino
+        self.next_tetromino = self.generate_tetromino()
+
+
+class VersusSimulation(Simulation):
+    def __init__(self, settings=None, seed=None):
+        super().__init__(settings, seed)
+        self.player_left = self.create_left_player(self.player.tetromino)
+        self.left_exists = True
+        self.right_exists = True
+
+    @property
+    def level(self):
+        level = (self.player.lines_cleared + self.player_left.lines_cleared) // 20 + 1
+        if level > 11:
+            return 11
+        else:
+            return level
+
+    @property
+    def gravity_interval(self):
+        if self.left_exists and self.right_exists:
+            return FALLING_SPEED[self.difficulty + self.level - 1]
+        else:
+            return FALLING_SPEED[self.difficulty + self.level + 2]
+
+    def create_left_player(self, tetromino):
+        return self.create_player(tetromino)
+
+    def tick(self):
+        speed = self.gravity_interval
+        if not self.left_exists and not self.right_exists:
+            self.replace_tetromino()
+        if self.count % speed == 0:
+            if self.right_exists:
+                self.right_exists = self.fall(self.player)
+            if self.left_exists:
+                self.left_exists = self.fall(self.player_left)
+        self.clear_lines(self.player)
+        self.clear_lines(self.player_left)
+        self.count += 1
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        return snapshot._replace(players=snapshot.players + (self.player_left.snapshot(),),
+                                 exists=(self.right_exists, self.left_exists))
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        self.player_left.restore(snapshot.players[1])
+        self.right_exists, self.left_exists = snapshot.exists
+
+    def step(self, action, left=False):
+        if self.recorder is not None:
+            self.recorder.record(self.count, action, left)
+        if left and self.left_exists:
+            self.player_left.apply(action)
+        if not left and self.right_exists:
+            self.player.apply(action)
+
+    def replace_tetromino(self):
+        self.player.tetromino = self.next_tetromino
+        self.player_left.tetromino = self.next_tetromino.copy()
+        self.next_tetromino = self.generate_tetromino()
+        if not self.player.is_valid_move() or not self.player_left.is_valid_move():
+            self.game_over = True
+        self.left_exists = True
+        self.right_exists = True
+
+    @staticmethod
+    def fall(player):
+        if player.is_valid_move(adj_y=1):
+            player.tetromino.move_down()
+            return True
+        player.blend_tetromino()
+        return False
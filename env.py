@@ -0,0 +1,220 @@
+from multiprocessing import Pipe, Process
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from engine import BOARD_HEIGHT, BOARD_WIDTH, KINDS, SHAPES, Action, Simulation
+from ai import COLUMN_BITS
+
+PLACEMENTS = tuple((rot, sideways) for rot in range(4) for sideways in range(-4, 6))
+FRAME_ACTIONS = (None,) + tuple(Action)
+KIND_INDEX = {kind: index for index, kind in enumerate(KINDS)}
+BOARD_SHAPE = (2, BOARD_HEIGHT, BOARD_WIDTH)
+
+
+def observation(boards, pieces, copy=True):
+    if copy:
+        return {'board': boards.copy(), 'pieces': pieces.copy()}
+    return {'board': boards, 'pieces': pieces}
+
+
+def placement_fits(player, action):
+    rot, sideways = PLACEMENTS[action]
+    tet = player.tetromino
+    return player.fits(SHAPES[tet.kind][(tet.rotation + rot) % 4], tet.pos[0] + sideways, tet.pos[1])
+
+
+class VectorEnv:
+    def __init__(self, num_envs, action_mode='placement', max_pieces=None, settings=None, boards=None, pieces=None,
+                 seed_stride=None, copy=True):
+        self.num_envs = num_envs
+        self.copy = copy
+        self.seed_stride = num_envs if seed_stride is None else seed_stride
+        self.action_mode = action_mode
+        self.max_pieces = max_pieces
+        self.settings = settings
+        self.action_count = len(PLACEMENTS) if action_mode == 'placement' else len(FRAME_ACTIONS)
+        self.boards = np.zeros((num_envs,) + BOARD_SHAPE, dtype=np.uint8) if boards is None else boards
+        self.pieces = np.zeros((num_envs, 2), dtype=np.int8) if pieces is None else pieces
+        self.rows = np.zeros((num_envs, BOARD_HEIGHT), dtype=np.int64)
+        self.simulations = [None] * num_envs
+        self.placed = np.zeros(num_envs, dtype=np.int64)
+        self.episodes = np.zeros(num_envs, dtype=np.int64)
+        self.seed = None
+
+    def reset(self, seed=None):
+        self.seed = seed
+        self.episodes[:] = 0
+        for index in range(self.num_envs):
+            self.reset_env(index)
+        self.observe()
+        return self.observation(), {}
+
+    def reset_env(self, index):
+        seed = None
+        if self.seed is not None:
+            seed = self.seed + index + int(self.episodes[index]) * self.seed_stride
+        self.simulations[index] = Simulation(self.settings, seed)
+        self.placed[index] = 0
+        self.episodes[index] += 1
+
+    def step(self, actions):
+        rewards = np.zeros(self.num_envs, dtype=np.int64)
+        terminated = np.zeros(self.num_envs, dtype=bool)
+        truncated = np.zeros(self.num_envs, dtype=bool)
+        final_lines = np.full(self.num_envs, -1, dtype=np.int64)
+        for index, action in enumerate(actions):
+            simulation = self.simulations[index]
+            lines_cleared = simulation.player.lines_cleared
+            if self.action_mode == 'placement':
+                if placement_fits(simulation.player, action):
+                    simulation.place(PLACEMENTS[action])
+                    self.placed[index] += 1
+                else:
+                    simulation.game_over = True
+            else:
+                if FRAME_ACTIONS[action] is not None:
+                    simulation.step(FRAME_ACTIONS[action])
+                current = simulation.player.tetromino
+                simulation.tick()
+                self.placed[index] += simulation.player.tetromino is not current
+            rewards[index] = simulation.player.lines_cleared - lines_cleared
+            terminated[index] = simulation.game_over
+            truncated[index] = self.max_pieces is not None and self.placed[index] >= self.max_pieces
+            if terminated[index] or truncated[index]:
+                final_lines[index] = simulation.player.lines_cleared
+                self.reset_env(index)
+        self.observe()
+        return self.observation(), rewards, terminated, truncated, {'final_lines_cleared': final_lines}
+
+    def observe(self):
+        for index, simulation in enumerate(self.simulations):
+            self.rows[index] = simulation.player.rows
+            self.pieces[index, 0] = KIND_INDEX[simulation.player.tetromino.kind]
+            self.pieces[index, 1] = KIND_INDEX[simulation.next_tetromino.kind]
+        self.boards[:, 0] = (self.rows[:, :, np.newaxis] & COLUMN_BITS) != 0
+        self.boards[:, 1] = 0
+        for index, simulation in enumerate(self.simulations):
+            tet = simulation.player.tetromino
+            for dx, dy in tet.squares:
+                x, y = tet.pos[0] + dx, tet.pos[1] + dy
+                if 0 <= y < BOARD_HEIGHT and 0 <= x < BOARD_WIDTH:
+                    self.boards[index, 1, y, x] = 1
+
+    def observation(self):
+        return observation(self.boards, self.pieces, self.copy)
+
+    def action_masks(self):
+        masks = np.ones((self.num_envs, self.action_count), dtype=bool)
+        if self.action_mode == 'placement':
+            for index, simulation in enumerate(self.simulations):
+                for action in range(self.action_count):
+                    masks[index, action] = placement_fits(simulation.player, action)
+        return masks
+
+    def close(self):
+        pass
+
+
+class TetrisEnv:
+    def __init__(self, action_mode='placement', max_pieces=None, settings=None):
+        self.vector = VectorEnv(1, action_mode, max_pieces, settings, copy=False)
+
+    @property
+    def simulation(self):
+        return self.vector.simulations[0]
+
+    def reset(self, seed=None):
+        observation, info = self.vector.reset(seed)
+        return self.unbatch(observation), info
+
+    def step(self, action):
+        observation, rewards, terminated, truncated, info = self.vector.step([action])
+        info = {'final_lines_cleared': int(info['final_lines_cleared'][0])}
+        return self.unbatch(observation), int(rewards[0]), bool(terminated[0]), bool(truncated[0]), info
+
+    def action_mask(self):
+        return self.vector.action_masks()[0]
+
+    @staticmethod
+    def unbatch(observation):
+        return {key: value[0].copy() for key, value in observation.items()}
+
+
+def subprocess_worker(connection, board_name, pieces_name, num_envs, start, stop, kwargs):
+    board_memory = SharedMemory(board_name)
+    pieces_memory = SharedMemory(pieces_name)
+    boards = np.ndarray((num_envs,) + BOARD_SHAPE, dtype=np.uint8, buffer=board_memory.buf)[start:stop]
+    pieces = np.ndarray((num_envs, 2), dtype=np.int8, buffer=pieces_memory.buf)[start:stop]
+    vector = VectorEnv(stop - start, boards=boards, pieces=pieces, seed_stride=num_envs, copy=False, **kwargs)
+    try:
+        while True:
+            command, data = connection.recv()
+            if command == 'reset':
+                vector.reset(data)
+                connection.send(None)
+            elif command == 'step':
+                _, rewards, terminated, truncated, info = vector.step(data)
+                connection.send((rewards, terminated, truncated, info['final_lines_cleared']))
+            elif command == 'masks':
+                connection.send(vector.action_masks())
+            elif command == 'close':
+                break
+    finally:
+        del boards, pieces, vector
+        board_memory.close()
+        pieces_memory.close()
+
+
+class SubprocessVectorEnv:
+    def __init__(self, num_envs, workers=2, action_mode='placement', max_pieces=None, settings=None, copy=True):
+        self.num_envs = num_envs
+        self.copy = copy
+        self.board_memory = SharedMemory(create=True, size=num_envs * int(np.prod(BOARD_SHAPE)))
+        self.pieces_memory = SharedMemory(create=True, size=num_envs * 2)
+        self.boards = np.ndarray((num_envs,) + BOARD_SHAPE, dtype=np.uint8, buffer=self.board_memory.buf)
+        self.pieces = np.ndarray((num_envs, 2), dtype=np.int8, buffer=self.pieces_memory.buf)
+        bounds = [int(bound) for bound in np.linspace(0, num_envs, min(workers, num_envs) + 1)]
+        self.slices = list(zip(bounds[:-1], bounds[1:]))
+        kwargs = {'action_mode': action_mode, 'max_pieces': max_pieces, 'settings': settings}
+        self.connections = []
+        self.processes = []
+        for start, stop in self.slices:
+            connection, child = Pipe()
+            process = Process(target=subprocess_worker, daemon=True,
+                              args=(child, self.board_memory.name, self.pieces_memory.name, num_envs, start, stop,
+                                    kwargs))
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def reset(self, seed=None):
+        for connection, (start, _) in zip(self.connections, self.slices):
+            connection.send(('reset', None if seed is None else seed + start))
+        for connection in self.connections:
+            connection.recv()
+        return observation(self.boards, self.pieces, self.copy), {}
+
+    def step(self, actions):
+        for connection, (start, stop) in zip(self.connections, self.slices):
+            connection.send(('step', list(actions[start:stop])))
+        results = [connection.recv() for connection in self.connections]
+        rewards, terminated, truncated, final_lines = (np.concatenate(parts) for parts in zip(*results))
+        return (observation(self.boards, self.pieces, self.copy), rewards, terminated, truncated,
+                {'final_lines_cleared': final_lines})
+
+    def action_masks(self):
+        for connection in self.connections:
+            connection.send(('masks', None))
+        return np.concatenate([connection.recv() for connection in self.connections])
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(('close', None))
+        for process in self.processes:
+            process.join()
+        del self.boards, self.pieces
+        self.board_memory.close()
+        self.board_memory.unlink()
+        self.pieces_memory.close()
+        self.pieces_memory.unlink()
@@ -1,21 +1,21 @@
-from enum import Enum
-
-from more_itertools import pairwise
+from controls import KeyRepeater, LatencyLog
+from engine import (BOARD_HEIGHT, BOARD_WIDTH, COLOR_NAMES, EMPTY, Action, Difficulty, Player, Settings,
+                    Simulation, VersusSimulation)
+from netplay import Client
+from profiler import PERCENTILES, FrameProfiler
+from replay import Recorder, Replay, ReplayPlayer, numbered_path, playback_speed, replay_seed
+from scheduler import FixedStepScheduler
+import ai
+from argparse import ArgumentParser
+from functools import lru_cache
 import numpy as np
 import pygame
-import random
-from copy import deepcopy
-from collections import Counter
-
-pygame.init()
-pygame.display.set_caption('TETRIS')
+import time
 
 BLOCK_SIZE = 30
 BLOCK_FILLING = 28
 BLOCK_MARGIN = 1
 INFO_WIDTH = 200
-BOARD_HEIGHT = 20
-BOARD_WIDTH = 10
 MAP_HEIGHT = BOARD_HEIGHT * BLOCK_SIZE
 MAP_WIDTH = 2 * BOARD_WIDTH * BLOCK_SIZE + INFO_WIDTH
 MAP_SIZE = [MAP_WIDTH, MAP_HEIGHT]
@@ -46,47 +46,11 @@ COLORS = {
 }
 
 
-class Difficulty(Enum):
-    EASY = 0
-    MEDIUM = 1
-    HARD = 2
-
-
-class Settings:
-    def __init__(self):
-        self.game_version = 1
-        self.difficulty = Difficulty.MEDIUM
-
-
-class Tetromino:
-    def __init__(self, color, position, squares, max_rotation):
-        self.color = color
-        self.pos = position
-        self.squares = squares
-        self.max_rot = max_rotation
-
-    def rotate(self, times=1):
-        if self.max_rot > 1:
-            for _ in range(times):
-                for square in self.squares:
-                    square[0], square[1] = -square[1], square[0]
-
-    def move_down(self, times=1):
-        self.pos[1] += times
-
-    def move_right(self, times=1):
-        self.pos[0] += times
-
-
-PIECES = {
-    'S': Tetromino('re', [4, 1], [[-1, 0], [0, 0], [0, -1], [1, -1]], 2),
-    'Z': Tetromino('gr', [4, 1], [[-1, -1], [0, -1], [0, 0], [1, 0]], 2),
-    'J': Tetromino('pi', [4, 1], [[0, -1], [0, 0], [0, 1], [-1, 1]], 4),
-    'L': Tetromino('or', [4, 1], [[0, -1], [0, 0], [0, 1], [1, 1]], 4),
-    'I': Tetromino('bl', [4, 2], [[0, -2], [0, -1], [0, 0], [0, 1]], 2),
-    'O': Tetromino('ye', [4, 0], [[0, 0], [1, 0], [0, 1], [1, 1]], 1),
-    'T': Tetromino('aq', [4, 1], [[-1, 0], [0, 0], [1, 0], [0, -1]], 4)
-}
+def start_display():
+    pygame.display.init()
+    pygame.font.init()
+    pygame.display.set_caption('TETRIS')
+    return pygame.display.set_mode(MAP_SIZE)
 
 
 def shut_down():
@@ -94,164 +58,280 @@ def shut_down():
     exit(1)
 
 
-class Player:
-    def __init__(self, tetromino, block_gird=np.full((BOARD_HEIGHT, BOARD_WIDTH), 'white')):
-        self.block_grid = deepcopy(block_gird)
-        self.tetromino = deepcopy(tetromino)
-        self.lines_cleared = 0
-
-    def is_valid_move(self, adj_x=0, adj_y=0, rot=0):
-        test_tet = deepcopy(self.tetromino)
-        test_tet.rotate(rot)
-        test_tet.move_down(adj_y)
-        test_tet.move_right(adj_x)
-        for square in test_tet.squares:
-            x = test_tet.pos[0] + square[0]
-            y = test_tet.pos[1] + square[1]
-            if self.is_outside_board(x, y) or self.is_colliding(x, y):
-                return False
-        return True
+@lru_cache(maxsize=None)
+def get_font(size):
+    if not pygame.font.get_init():
+        pygame.font.init()
+    return pygame.font.SysFont('monospace', size)
 
-    @staticmethod
-    def is_outside_board(x, y):
-        return x < 0 or x > BOARD_WIDTH - 1 or y > BOARD_HEIGHT - 1
 
-    def is_colliding(self, x, y):
-        return self.block_grid[y][x] != 'white'
+@lru_cache(maxsize=256)
+def render_text(text, size):
+    return get_font(size).render(text, True, WHITE)
 
-    def blend_tetromino(self):
-        for square in self.tetromino.squares:
-            x = self.tetromino.pos[0] + square[0]
-            y = self.tetromino.pos[1] + square[1]
-            self.block_grid[y][x] = self.tetromino.color
 
-    def clear_lines(self):
-        for i, row in enumerate(self.block_grid):
-            if np.any([color == 'white' for color in row]):
-                continue
-            self.block_grid = np.delete(self.block_grid, i, axis=0)
-            clear_row = np.full((1, BOARD_WIDTH), 'white')
-            self.block_grid = np.vstack((clear_row, self.block_grid))
-            self.lines_cleared += 1
+def draw_block(surface, x, y, color, shift):
+    pygame.draw.rect(surface, BLACK,
+                     [x * BLOCK_SIZE + shift, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE])
+    pygame.draw.rect(surface, COLORS[color],
+                     [x * BLOCK_SIZE + BLOCK_MARGIN + shift,
+                      y * BLOCK_SIZE + BLOCK_MARGIN,
+                      BLOCK_FILLING, BLOCK_FILLING])
 
 
 class RealPlayer(Player):
     def __init__(self, tetromino, k_left=pygame.K_LEFT, k_right=pygame.K_RIGHT, k_up=pygame.K_UP, k_down=pygame.K_DOWN, k_space=pygame.K_SPACE):
         super().__init__(tetromino)
-        self.k_left = k_left
-        self.k_right = k_right
-        self.k_up = k_up
-        self.k_down = k_down
-        self.k_space = k_space
-
-    def respond_to_control(self, key):
-        if key == self.k_right:
-            if self.is_valid_move(adj_x=1):
-                self.tetromino.move_right()
-        if key == self.k_left:
-            if self.is_valid_move(adj_x=-1):
-                self.tetromino.move_right(-1)
-        if key == self.k_down:
-            if self.is_valid_move(adj_y=1):
-                self.tetromino.move_down()
-        if key == self.k_up:
-            if self.is_valid_move(rot=1):
-                self.tetromino.rotate()
-        if key == self.k_space:
-            while self.is_valid_move(adj_y=1):
-                self.tetromino.move_down()
-
-
-class Game:
+        self.controls = {
+            k_left: Action.LEFT,
+            k_right: Action.RIGHT,
+            k_up: Action.ROTATE,
+            k_down: Action.DOWN,
+            k_space: Action.DROP
+        }
+
+
+class Game(Simulation):
     def __init__(self, game_display, settings):
+        super().__init__(settings)
         self.game_display = game_display
-        self.settings = settings
-        self.difficulty = settings.difficulty.value
-        self.player = RealPlayer(self.generate_tetromino())
-        self.next_tetromino = self.generate_tetromino()
-        self.game_over = False
-        self.count = 1
-        self.falling_speed = [40, 28, 24, 21, 18, 15, 13, 12, 11, 10, 10, 10, 10, 10, 10, 10, 10]
+        self.board_surfaces = {}
+        self.profiler = FrameProfiler(bool(settings.profile_path or settings.profile_overlay))
+        self.scheduler = FixedStepScheduler(settings.tick_rate, settings.render_cap)
+        self.latency_log = LatencyLog() if settings.latency_path else None
+        self.pending_events = []
+        self.closed = False
+        for player, _ in self.controlled_players():
+            player.repeater = KeyRepeater(player.controls, settings.das, settings.arr,
+                                          self.scheduler.max_steps * self.scheduler.step)
+        self.invalidate()
+        if settings.record_path:
+            Recorder(self)
 
     @property
     def shift(self):
         return (MAP_WIDTH / 2) - (BOARD_WIDTH * BLOCK_SIZE / 2)
 
-    @property
-    def level(self):
-        level = self.player.lines_cleared // 10 + 1
-        if level > 11:
-            return 11
-        else:
-            return level
-
     @staticmethod
-    def generate_tetromino():
-        return deepcopy(random.choice(list(PIECES.values())))
+    def create_player(tetromino):
+        return RealPlayer(tetromino)
 
     def run(self):
+        self.scheduler.reset()
         while not self.game_over:
-            if self.count % (self.falling_speed[self.difficulty + self.level - 1]) == 0:
-                if self.player.is_valid_move(adj_y=1):
-                    self.player.tetromino.move_down()
-                else:
-                    self.player.blend_tetromino()
-                    self.player.clear_lines()
-                    self.replace_tetromino()
-                    if not self.player.is_valid_move():
-                        self.game_over = True
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    shut_down()
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_p:
-                        self.pause()
-                    self.player.respond_to_control(event.key)
-            self.draw()
-            pygame.display.update()
-            CLOCK.tick(FPS)
-            self.count += 1
+            self.profiler.start_frame()
+            with self.profiler.phase('events'):
+                events = self.pending_events + pygame.event.get()
+                self.pending_events = []
+                for event in events:
+                    if event.type == pygame.QUIT:
+                        self.teardown()
+                        shut_down()
+                    if event.type == pygame.KEYDOWN:
+                        if event.key == pygame.K_p:
+                            self.pause()
+                        self.respond_to_control(event.key)
+                        self.scheduler.mark_dirty()
+                    if event.type == pygame.KEYUP:
+                        self.release_control(event.key)
+            with self.profiler.phase('gravity'):
+                steps = self.scheduler.advance()
+                for due in self.scheduler.step_times(steps):
+                    self.repeat_controls(due)
+                    self.tick()
+                    if self.game_over:
+                        break
+                if not self.game_over:
+                    self.repeat_controls(self.scheduler.last)
+            if steps:
+                self.scheduler.mark_dirty()
+            rendered = self.scheduler.should_render()
+            if rendered:
+                with self.profiler.phase('draw'):
+                    self.present()
+            if not steps and not rendered:
+                self.profiler.skip_frame()
+            self.profiler.end_frame()
+            self.wait_for_input(self.input_delay())
+        self.teardown()
         self.show_results()
 
-    def replace_tetromino(self):
-        self.player.tetromino = self.next_tetromino
-        self.next_tetromino = self.generate_tetromino()
+    def teardown(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.save_recording()
+        self.save_profile()
+        self.save_latency()
+
+    def controlled_players(self):
+        return [(self.player, False)]
+
+    def respond_to_control(self, key, now=None):
+        now = time.perf_counter() if now is None else now
+        for player, left in self.controlled_players():
+            action = player.repeater.press(key, now)
+            if action is not None:
+                self.apply_control(action, left, False, now)
+
+    def release_control(self, key):
+        for player, _ in self.controlled_players():
+            player.repeater.release(key)
+
+    def repeat_controls(self, now):
+        pressed = pygame.key.get_pressed()
+        for player, left in self.controlled_players():
+            for action, due in player.repeater.repeats(now, pressed.__getitem__):
+                self.apply_control(action, left, True, due)
+
+    def apply_control(self, action, left, repeat, since):
+        player = self.player_left if left else self.player
+        before = player.tetromino.state
+        if left:
+            self.step(action, left=True)
+        else:
+            self.step(action)
+        if player.tetromino.state != before:
+            self.scheduler.mark_dirty()
+            if self.latency_log is not None:
+                self.latency_log.record(action, left, repeat, since, time.perf_counter())
+
+    def input_delay(self):
+        due = min(player.repeater.next_due() for player, _ in self.controlled_players())
+        return min(self.scheduler.delay(), due - time.perf_counter())
+
+    def wait_for_input(self, delay):
+        if delay <= 0:
+            return
+        event = pygame.event.wait(max(1, int(delay * 1000)))
+        if event.type != pygame.NOEVENT:
+            self.pending_events.append(event)
+
+    def save_latency(self):
+        if self.latency_log is not None:
+            self.latency_log.dump(self.settings.latency_path)
+            summary = self.latency_log.summary()
+            print(f"{summary['inputs']} inputs, key to move p50/p95/p99 "
+                  f"{'/'.join(f'{value:.2f}' for value in summary['applied_ms'].values())} ms, key to display "
+                  f"{'/'.join(f'{value:.2f}' for value in summary['displayed_ms'].values())} ms")
+
+    def save_recording(self):
+        if self.recorder is not None:
+            self.settings.recorded_games += 1
+            self.recorder.save(numbered_path(self.settings.record_path, self.settings.recorded_games))
+            self.recorder = None
+
+    def save_profile(self):
+        if self.settings.profile_path:
+            self.profiler.dump(self.settings.profile_path)
+
+    def clear_lines(self, player):
+        with self.profiler.phase('line_clear'):
+            return super().clear_lines(player)
+
+    def invalidate(self):
+        self.drawn = {}
+        self.full_redraw = True
+
+    def present(self):
+        rects = self.draw()
+        if rects:
+            pygame.display.update(rects)
+            if self.latency_log is not None:
+                self.latency_log.displayed(time.perf_counter())
+
+    def begin_frame(self):
+        if not self.full_redraw:
+            return []
+        self.full_redraw = False
+        self.game_display.fill(BLACK)
+        return [self.game_display.get_rect()]
 
     def draw(self):
-        self.game_display.fill(BLACK)
-        self.draw_board(self.player.block_grid, self.shift)
-        self.draw_tetromino(self.player.tetromino, self.shift)
-        self.draw_next_tetromino(self.shift + BOARD_WIDTH * BLOCK_SIZE + 50)
-        self.print_score()
-
-    def draw_board(self, block_grid, shift):
-        pygame.draw.rect(self.game_display, WHITE, [shift, 0, BOARD_WIDTH * BLOCK_SIZE, BOARD_HEIGHT * BLOCK_SIZE])
-        for y, row in enumerate(block_grid):
-            for x, color in enumerate(row):
-                if color != 'white':
-                    self.draw_rect(x, y, color, shift)
+        rects = self.begin_frame()
+        rects += self.draw_playfield(self.player, self.active_tetrominoes(), self.shift)
+        rects += self.draw_next_tetromino(self.shift + BOARD_WIDTH * BLOCK_SIZE + 50)
+        rects += self.print_score()
+        rects += self.draw_profile()
+        return rects
+
+    def active_tetrominoes(self):
+        return [self.player.tetromino]
+
+    def draw_playfield(self, player, tetrominoes, shift):
+        key = (player.board_version, tuple(tet.state for tet in tetrominoes))
+        if self.drawn.get(('board', shift)) == key:
+            return []
+        self.drawn[('board', shift)] = key
+        self.draw_board(player, shift)
+        for tet in tetrominoes:
+            self.draw_tetromino(tet, shift)
+        return [pygame.Rect(shift, 0, BOARD_WIDTH * BLOCK_SIZE, BOARD_HEIGHT * BLOCK_SIZE)]
+
+    def draw_board(self, player, shift):
+        self.game_display.blit(self.board_surface(player), [shift, 0])
+
+    def board_surface(self, player):
+        surface, version = self.board_surfaces.get(player, (None, None))
+        if version != player.board_version:
+            if surface is None:
+                surface = pygame.Surface([BOARD_WIDTH * BLOCK_SIZE, BOARD_HEIGHT * BLOCK_SIZE])
+            surface.fill(WHITE)
+            block_grid = player.block_grid
+            for y, x in np.argwhere(block_grid != EMPTY):
+                draw_block(surface, x, y, COLOR_NAMES[block_grid[y, x]], 0)
+            self.board_surfaces[player] = (surface, player.board_version)
+        return surface
 
     def draw_rect(self, x, y, color, shift):
-        pygame.draw.rect(self.game_display, BLACK,
-                         [x * BLOCK_SIZE + shift, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE])
-        pygame.draw.rect(self.game_display, COLORS[color],
-                         [x * BLOCK_SIZE + BLOCK_MARGIN + shift,
-                          y * BLOCK_SIZE + BLOCK_MARGIN,
-                          BLOCK_FILLING, BLOCK_FILLING])
+        draw_block(self.game_display, x, y, color, shift)
 
     def draw_tetromino(self, tetromino, shift):
         tet = tetromino
         for square in tet.squares:
             self.draw_rect(tet.pos[0] + square[0], tet.pos[1] + square[1], tet.color, shift)
 
+    @property
+    def score_rect(self):
+        x = self.shift + BOARD_WIDTH * BLOCK_SIZE + 30
+        return pygame.Rect(x, MAP_HEIGHT / 2, MAP_WIDTH - x, 80)
+
+    def score_texts(self):
+        return [(f"Lines cleared: {self.player.lines_cleared}", 20,
+                 [self.shift + BOARD_WIDTH * BLOCK_SIZE + 30, MAP_HEIGHT / 2])]
+
     def print_score(self):
-        font = pygame.font.SysFont('monospace', 20)
-        text1 = font.render(f"Lines cleared: {self.player.lines_cleared}", True, WHITE)
-        self.game_display.blit(text1, [self.shift + BOARD_WIDTH * BLOCK_SIZE + 30, MAP_HEIGHT / 2])
+        return self.draw_texts('score', self.score_rect, self.score_texts())
+
+    @property
+    def profile_rect(self):
+        return pygame.Rect(0, 0, self.shift, 120)
+
+    def profile_texts(self):
+        x, y = self.profile_rect.topleft
+        texts = [(f"{'ms':10}" + ''.join(f"{f'p{p}':>6}" for p in PERCENTILES), 12, [x + 10, y + 10])]
+        for index, (name, values) in enumerate(self.profiler.percentiles().items()):
+            texts.append((f"{name:10}" + ''.join(f"{values[p] * 1000:6.1f}" for p in PERCENTILES), 12,
+                          [x + 10, y + 26 + 14 * index]))
+        return texts
+
+    def draw_profile(self):
+        if not self.settings.profile_overlay or ('profile' in self.drawn and self.count % 30):
+            return []
+        return self.draw_texts('profile', self.profile_rect, self.profile_texts())
+
+    def draw_texts(self, key, rect, texts):
+        if self.drawn.get(key) == texts:
+            return []
+        self.drawn[key] = texts
+        self.game_display.fill(BLACK, rect)
+        for text, size, position in texts:
+            self.game_display.blit(render_text(text, size), position)
+        return [rect]
 
     def show_results(self):
         self.game_display.fill(BLACK)
-        font = pygame.font.SysFont('monospace', 20)
+        font = get_font(20)
         text1 = font.render(f"Congratulations!!! You cleared {self.player.lines_cleared} lines", True, WHITE)
         self.game_display.blit(text1, [60, MAP_HEIGHT/2 - 60])
         text2 = font.render("Press b to go back to menu", True, WHITE)
@@ -269,14 +349,19 @@ class Game:
         intro.run()
 
     def draw_next_tetromino(self, shift):
-        pygame.draw.rect(self.game_display, WHITE, [shift, BLOCK_SIZE, 5 * BLOCK_SIZE, 6 * BLOCK_SIZE])
         tet = self.next_tetromino
+        if self.drawn.get('next') == tet.state:
+            return []
+        self.drawn['next'] = tet.state
+        rect = pygame.Rect(shift, BLOCK_SIZE, 5 * BLOCK_SIZE, 6 * BLOCK_SIZE)
+        pygame.draw.rect(self.game_display, WHITE, rect)
         for square in tet.squares:
             self.draw_rect(tet.pos[0] + square[0] - 2, tet.pos[1] + square[1] + 2, tet.color, shift)
+        return [rect]
 
     def pause(self):
         self.game_display.fill(BLACK)
-        font = pygame.font.SysFont('monospace', 20)
+        font = get_font(20)
         text = font.render("Press p to continue playing", True, WHITE)
         self.game_display.blit(text, [MAP_WIDTH / 2 - 150, MAP_HEIGHT / 2 - 30])
         text = font.render("Press b to go back to menu", True, WHITE)
@@ -286,84 +371,38 @@ class Game:
         while loop:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
+                    self.teardown()
                     shut_down()
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_b:
                         loop = False
+                        self.teardown()
                         new_intro = Intro(self.game_display, self.settings)
                         new_intro.run()
                     if event.key == pygame.K_p:
                         loop = False
+        self.profiler.skip_frame()
+        self.scheduler.reset()
+        for player, _ in self.controlled_players():
+            player.repeater.reset(self.scheduler.last)
+        self.invalidate()
 
 
-class GameFor2(Game):
-    def __init__(self, game_display, settings):
-        super().__init__(game_display, settings)
-        self.player_left = RealPlayer(self.player.tetromino, k_left=pygame.K_a, k_right=pygame.K_d, k_up=pygame.K_w, k_down=pygame.K_s, k_space=pygame.K_t)
-        self.left_exists = True
-        self.right_exists = True
-
+class GameFor2(Game, VersusSimulation):
     @property
     def shift(self):
         return BOARD_WIDTH * BLOCK_SIZE + INFO_WIDTH
 
-    @property
-    def level(self):
-        level = (self.player.lines_cleared + self.player_left.lines_cleared) // 20 + 1
-        if level > 11:
-            return 11
-        else:
-            return level
-
-    def run(self):
-        while not self.game_over:
-            if self.left_exists and self.right_exists:
-                speed = self.falling_speed[self.difficulty + self.level - 1]
-            else:
-                speed = self.falling_speed[self.difficulty + self.level + 2]
-            if not self.left_exists and not self.right_exists:
-                self.player.tetromino = self.next_tetromino
-                self.player_left.tetromino = deepcopy(self.next_tetromino)
-                self.next_tetromino = self.generate_tetromino()
-                if not self.player.is_valid_move() or not self.player_left.is_valid_move():
-                    self.game_over = True
-                self.left_exists = True
-                self.right_exists = True
-
-            if self.count % speed == 0:
-                if self.right_exists:
-                    if self.player.is_valid_move(adj_y=1):
-                        self.player.tetromino.move_down()
-                    else:
-                        self.player.blend_tetromino()
-                        self.right_exists = False
-                if self.left_exists:
-                    if self.player_left.is_valid_move(adj_y=1):
-                        self.player_left.tetromino.move_down()
-                    else:
-                        self.player_left.blend_tetromino()
-                        self.left_exists = False
+    @staticmethod
+    def create_left_player(tetromino):
+        return RealPlayer(tetromino, k_left=pygame.K_a, k_right=pygame.K_d, k_up=pygame.K_w, k_down=pygame.K_s, k_space=pygame.K_t)
 
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    shut_down()
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_p:
-                        self.pause()
-                    if self.right_exists:
-                        self.player.respond_to_control(event.key)
-                    if self.left_exists:
-                        self.player_left.respond_to_control(event.key)
-            self.player.clear_lines()
-            self.player_left.clear_lines()
-            self.draw()
-            CLOCK.tick(FPS)
-            self.count += 1
-        self.show_results()
+    def controlled_players(self):
+        return [(self.player, False), (self.player_left, True)]
 
     def show_results(self):
         self.game_display.fill(BLACK)
-        font = pygame.font.SysFont('monospace', 20)
+        font = get_font(20)
         text1 = font.render(f"Left player cleared {self.player_left.lines_cleared} lines", True, WHITE)
         self.game_display.blit(text1, [60, MAP_HEIGHT/2 - 60])
         text1 = font.render(f"Right player cleared {self.player.lines_cleared} lines", True, WHITE)
@@ -383,141 +422,215 @@ class GameFor2(Game):
         intro.run()
 
     def draw(self):
-        self.game_display.fill(BLACK)
-        self.draw_board(self.player.block_grid, self.shift)
-        if self.right_exists:
-            self.draw_tetromino(self.player.tetromino, self.shift)
-        self.draw_board(self.player_left.block_grid, 0)
-        if self.left_exists:
-            self.draw_tetromino(self.player_left.tetromino, 0)
-        self.draw_next_tetromino(BOARD_WIDTH * BLOCK_SIZE + 20)
-        self.print_score()
-        pygame.display.update()
+        rects = self.begin_frame()
+        rects += self.draw_playfield(self.player, [self.player.tetromino] if self.right_exists else [], self.shift)
+        rects += self.draw_playfield(self.player_left, [self.player_left.tetromino] if self.left_exists else [], 0)
+        rects += self.draw_next_tetromino(BOARD_WIDTH * BLOCK_SIZE + 20)
+        rects += self.print_score()
+        rects += self.draw_profile()
+        return rects
 
-    def print_score(self):
-        font = pygame.font.SysFont('monospace', 12)
-        text1 = font.render(f"Left lines cleared: {self.player_left.lines_cleared}", True, WHITE)
-        self.game_display.blit(text1, [BOARD_WIDTH * BLOCK_SIZE + 10, MAP_HEIGHT / 2])
-        text2 = font.render(f"Right lines cleared: {self.player.lines_cleared}", True, WHITE)
-        self.game_display.blit(text2, [BOARD_WIDTH * BLOCK_SIZE + 10, MAP_HEIGHT / 2 - 30])
+    @property
+    def score_rect(self):
+        return pygame.Rect(BOARD_WIDTH * BLOCK_SIZE, MAP_HEIGHT / 2 - 30, INFO_WIDTH, 50)
+
+    @property
+    def profile_rect(self):
+        return pygame.Rect(BOARD_WIDTH * BLOCK_SIZE, MAP_HEIGHT / 2 + 30, INFO_WIDTH, 120)
+
+    def score_texts(self):
+        return [(f"Left lines cleared: {self.player_left.lines_cleared}", 12,
+                 [BOARD_WIDTH * BLOCK_SIZE + 10, MAP_HEIGHT / 2]),
+                (f"Right lines cleared: {self.player.lines_cleared}", 12,
+                 [BOARD_WIDTH * BLOCK_SIZE + 10, MAP_HEIGHT / 2 - 30])]
 
 
 class GameWithAI(Game):
     def __init__(self, game_display, settings):
         super().__init__(game_display, settings)
-        self.best_move = self.find_best_move()
-        self.clue_tetromino = self.fit_clue_tetromino()
+        self.search_stats = ai.SearchStats()
+        self.hint_weights = settings.hint_weights or ai.DEFAULT_WEIGHTS
+        self.hint_worker = None
+        self.evaluation_cache = None
+        if settings.hint_async:
+            self.hint_worker = ai.HintWorker(settings.hint_processes, settings.hint_cache_size)
+            self.evaluation_cache = self.hint_worker.cache
+        elif settings.hint_cache_size:
+            self.evaluation_cache = ai.EvaluationCache(settings.hint_cache_size)
+        self.best_move = None
+        self.beam_line = None
+        self.clue_tetromino = None
+        self.request_hint()
+
+    @property
+    def beam(self):
+        if not self.settings.hint_beam:
+            return None
+        return self.settings.hint_beam_width, self.settings.hint_beam_depth, self.settings.hint_beam_budget
+
+    def request_hint(self):
+        with self.profiler.phase('hint'):
+            if self.hint_worker is not None:
+                self.best_move = None
+                self.clue_tetromino = None
+                self.hint_worker.submit(self.player, self.next_tetromino, self.settings.hint_lookahead,
+                                        self.settings.hint_time_budget, self.hint_weights, self.settings.hint_reachable,
+                                        self.beam)
+            else:
+                self.best_move = self.find_best_move()
+                self.clue_tetromino = self.fit_clue_tetromino()
+
+    def tick(self):
+        super().tick()
+        if self.hint_worker is not None:
+            with self.profiler.phase('hint'):
+                result = self.hint_worker.poll()
+                if result is not None:
+                    self.best_move, nodes, elapsed, self.beam_line = result
+                    self.search_stats.record(nodes, elapsed)
+                    self.clue_tetromino = self.fit_clue_tetromino()
 
     def fit_clue_tetromino(self):
-        player_AI = Player(deepcopy(self.player.tetromino), deepcopy(self.player.block_grid))
-        player_AI.tetromino.rotate(times=self.best_move[0])
-        player_AI.tetromino.move_right(times=self.best_move[1])
-        while player_AI.is_valid_move(adj_y=1):
-            player_AI.tetromino.move_down()
-        player_AI.tetromino.color = 'cc'
-        return deepcopy(player_AI.tetromino)
+        return ai.fit_clue_tetromino(self.player, self.best_move)
 
     def find_initial_moves(self):
-        move_list = []
-        score_list = []
-        for rot in range(self.player.tetromino.max_rot):
-            for sideways in range(-4, 6):
-                move = (rot, sideways)
-                result_board, lines_cleared = self.hypothetic_settle(move)
-                if result_board is not None:
-                    score = Calculator(result_board, lines_cleared).calculate()
-                    move_list.append(move)
-                    score_list.append(score)
-        move_to_score = Counter(dict(zip(move_list, score_list)))
-        best_moves = [move for move, score in move_to_score.most_common(4)]
-        return best_moves
+        return ai.find_initial_moves(self.player)
 
     def hypothetic_settle(self, move):
-        player = Player(deepcopy(self.player.tetromino), deepcopy(self.player.block_grid))
-        player.tetromino.rotate(move[0])
-        player.tetromino.move_right(move[1])
-        if not player.is_valid_move():
-            return None, 0
-        while player.is_valid_move(adj_y=1):
-            player.tetromino.move_down()
-        player.blend_tetromino()
-        player.clear_lines()
-        return player.block_grid, player.lines_cleared
+        return ai.hypothetic_settle(self.player, move)
 
-    def draw(self):
-        self.game_display.fill(BLACK)
-        self.draw_board(self.player.block_grid, self.shift)
-        self.draw_tetromino(self.clue_tetromino, self.shift)
-        self.draw_tetromino(self.player.tetromino, self.shift)
-        self.draw_next_tetromino(self.shift + BOARD_WIDTH * BLOCK_SIZE + 50)
-        self.print_score()
+    def active_tetrominoes(self):
+        if self.clue_tetromino is None:
+            return [self.player.tetromino]
+        return [self.clue_tetromino, self.player.tetromino]
 
     def replace_tetromino(self):
         super().replace_tetromino()
-        self.best_move = self.find_best_move()
-        self.clue_tetromino = self.fit_clue_tetromino()
+        self.request_hint()
+
+    def teardown(self):
+        super().teardown()
+        if self.hint_worker is not None:
+            self.hint_worker.shutdown()
 
     def find_best_move(self):
-        move_list = []
-        score_list = []
-        for rot in range(self.player.tetromino.max_rot):
-            for sideways in range(-4, 6):
-                move = [rot, sideways]
-                result_board, lines_cleared = self.hypothetic_settle(move)
-                if result_board is not None:
-                    score = Calculator(result_board, lines_cleared).calculate()
-                    move_list.append(move)
-                    score_list.append(score)
-        return move_list[score_list.index(max(score_list))]
-
-
-class Calculator:
-    def __init__(self, block_grid, lines_cleared):
-        self.block_grid = block_grid
-        self.lines_cleared = lines_cleared
-
-    def calculate(self):
-        score = 40 * self.lines_cleared
-        score += -2 * self.bumpiness()
-        score += -30 * self.holes_simple()
-        if self.is_it_game_over():
-            score += -2000
-        return score
-
-    def bumpiness(self):
-        column_heights = [self.column_height(column) for column in self.block_grid.T]
-        result = sum(abs(pair[0] - pair[1]) for pair in pairwise(column_heights))
-        if column_heights[1] > column_heights[0]:
-            result += column_heights[1] - column_heights[0]
-        if column_heights[-2] > column_heights[-1]:
-            result += column_heights[-2] - column_heights[-1]
-        return result
-
-    def holes_simple(self):
-        return sum(self.column_holes(column) for column in self.block_grid.T)
-
-    def is_it_game_over(self):
-        danger_zone = [[3, 2], [4, 2], [5, 2], [4, 3]]
-        return np.any([self.block_grid[y][x] != 'white' for x, y in danger_zone])
+        if self.beam is not None:
+            width, depth, budget = self.beam
+            kinds = (self.player.tetromino.kind, self.next_tetromino.kind)
+            move, self.beam_line = ai.find_beam_move(self.player, kinds, width, depth, budget, self.search_stats,
+                                                     self.hint_weights, self.settings.hint_reachable)
+            return move
+        if self.settings.hint_lookahead:
+            return ai.find_lookahead_move(self.player, self.next_tetromino,
+                                          time_budget=self.settings.hint_time_budget, stats=self.search_stats,
+                                          cache=self.evaluation_cache, weights=self.hint_weights,
+                                          reachable=self.settings.hint_reachable)
+        return ai.find_best_move(self.player, self.evaluation_cache, self.hint_weights, self.settings.hint_reachable)
 
-    @staticmethod
-    def column_height(column):
-        height = BOARD_HEIGHT
-        for color in column:
-            if color != 'white':
-                break
-            height -= 1
-        return height
+    @property
+    def score_rect(self):
+        rect = super().score_rect
+        rect.height = 130
+        return rect
+
+    def score_texts(self):
+        texts = super().score_texts()
+        x = self.shift + BOARD_WIDTH * BLOCK_SIZE + 30
+        texts.append((f"Hint nodes/s: {self.search_stats.nodes_per_second:.0f}", 12, [x, MAP_HEIGHT / 2 + 30]))
+        if self.evaluation_cache is not None:
+            texts.append((f"Hint cache hits: {self.evaluation_cache.hit_rate:.0%}", 12, [x, MAP_HEIGHT / 2 + 50]))
+        if isinstance(self.best_move, ai.Placement):
+            texts.append((f"Keys: {ai.key_path(self.best_move)}", 12, [x, MAP_HEIGHT / 2 + 70]))
+        if self.beam_line is not None:
+            line = self.beam_line
+            texts.append((f"Beam line: {line.depth} pieces, {line.lines} lines", 12, [x, MAP_HEIGHT / 2 + 90]))
+            texts.append((f"Beam score: {line.score:.0f}", 12, [x, MAP_HEIGHT / 2 + 110]))
+        return texts
+
+
+class NetworkGame(GameFor2):
+    def __init__(self, game_display, settings, client):
+        self.client = client
+        super().__init__(game_display, settings)
+        self.recorder = None
 
-    def column_holes(self, column):
-        highest = self.column_height(column)
-        return sum(1 for i in range(BOARD_HEIGHT - highest, BOARD_HEIGHT) if (column[i] == 'white'))
+    def controlled_players(self):
+        return [(self.player, False)]
+
+    def run(self):
+        text = render_text("Waiting for an opponent...", 20)
+        while self.client.side is None and not self.client.finished:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.teardown()
+                    shut_down()
+            self.game_display.fill(BLACK)
+            self.game_display.blit(text, [60, MAP_HEIGHT / 2])
+            pygame.display.update()
+            CLOCK.tick(FPS)
+        self.invalidate()
+        super().run()
+
+    def tick(self):
+        client = self.client
+        for player, mirror in ((self.player, client.player), (self.player_left, client.player_left)):
+            player.rows = mirror.rows
+            player.block_grid = mirror.block_grid
+            player.tetromino = mirror.tetromino
+            player.lines_cleared = mirror.lines_cleared
+            player.board_version = mirror.board_version
+        self.next_tetromino = client.next_tetromino
+        self.right_exists = client.right_exists
+        self.left_exists = client.left_exists
+        self.count = client.frame
+        self.game_over = client.finished
+
+    def step(self, action, left=False):
+        self.client.send_input(action)
+
+
+class ReplayMixin:
+    def __init__(self, game_display, replay, speed=1.0):
+        super().__init__(game_display, replay.settings())
+        self.replay_player = ReplayPlayer(replay, self)
+        self.scheduler = FixedStepScheduler(self.settings.tick_rate * speed, self.settings.render_cap,
+                                            max(8, int(8 * speed)))
+
+    def run(self):
+        self.scheduler.reset()
+        while not self.replay_player.finished:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.teardown()
+                    shut_down()
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_p:
+                    self.pause()
+            steps = self.scheduler.advance()
+            for _ in range(steps):
+                if self.replay_player.finished:
+                    break
+                self.replay_player.advance()
+            if steps:
+                self.scheduler.mark_dirty()
+            if self.scheduler.should_render():
+                self.present()
+            self.scheduler.wait()
+        self.teardown()
+        self.show_results()
+
+
+class ReplayGame(ReplayMixin, Game):
+    pass
+
+
+class ReplayGameFor2(ReplayMixin, GameFor2):
+    pass
 
 
 class Intro:
-    def __init__(self, game_display=pygame.display.set_mode(MAP_SIZE), settings=Settings()):
-        self.game_display = game_display
-        self.settings = settings
+    def __init__(self, game_display=None, settings=None):
+        self.game_display = start_display() if game_display is None else game_display
+        self.settings = Settings() if settings is None else settings
 
     def run(self):
         intro = True
@@ -556,50 +669,99 @@ class Intro:
         pygame.display.update()
 
     def _print_instructions(self):
-        font0 = pygame.font.SysFont('monospace', 45)
-        text0 = font0.render("TETRIS", True, WHITE)
+        text0 = render_text("TETRIS", 45)
         self.game_display.blit(text0, [627, 10])
-        font = pygame.font.SysFont('monospace', 20)
-        text1 = font.render("Press 1 for classic game", True, WHITE)
-        text2 = font.render("Press 2 for two player game", True, WHITE)
-        text3 = font.render("Press 3 for game with hints", True, WHITE)
-        text4 = font.render("Press e, m or h to choose difficulty", True, WHITE)
+        text1 = render_text("Press 1 for classic game", 20)
+        text2 = render_text("Press 2 for two player game", 20)
+        text3 = render_text("Press 3 for game with hints", 20)
+        text4 = render_text("Press e, m or h to choose difficulty", 20)
         self.game_display.blit(text1, [200, 70])
         self.game_display.blit(text2, [200, 100])
         self.game_display.blit(text3, [200, 130])
         self.game_display.blit(text4, [200, 180])
         if self.settings.game_version != 2:
-            text5 = font.render("Controls:", True, WHITE)
-            text6 = font.render("Use arrows to move tetromino", True, WHITE)
-            text7 = font.render("Use up arrow to rotate", True, WHITE)
-            text8 = font.render("Use space to drop", True, WHITE)
+            text5 = render_text("Controls:", 20)
+            text6 = render_text("Use arrows to move tetromino", 20)
+            text7 = render_text("Use up arrow to rotate", 20)
+            text8 = render_text("Use space to drop", 20)
             self.game_display.blit(text5, [130, 290])
             self.game_display.blit(text6, [40, 345])
             self.game_display.blit(text7, [70, 375])
             self.game_display.blit(text8, [100, 405])
         else:
-            text5 = font.render("Controls:", True, WHITE)
+            text5 = render_text("Controls:", 20)
             self.game_display.blit(text5, [320, 260])
-            text6 = font.render("Right player", True, WHITE)
-            text7 = font.render("Use arrows to move tetromino", True, WHITE)
-            text8 = font.render("Use up arrow to rotate", True, WHITE)
-            text9 = font.render("Use space to drop", True, WHITE)
+            text6 = render_text("Right player", 20)
+            text7 = render_text("Use arrows to move tetromino", 20)
+            text8 = render_text("Use up arrow to rotate", 20)
+            text9 = render_text("Use space to drop", 20)
             self.game_display.blit(text6, [500, 320])
             self.game_display.blit(text7, [410, 370])
             self.game_display.blit(text8, [440, 400])
             self.game_display.blit(text9, [470, 430])
-            text10 = font.render("Left player", True, WHITE)
-            text11 = font.render("Use a s d to move tetromino", True, WHITE)
-            text12 = font.render("Use w to rotate", True, WHITE)
-            text13 = font.render("Use t to drop", True, WHITE)
+            text10 = render_text("Left player", 20)
+            text11 = render_text("Use a s d to move tetromino", 20)
+            text12 = render_text("Use w to rotate", 20)
+            text13 = render_text("Use t to drop", 20)
             self.game_display.blit(text10, [120, 320])
             self.game_display.blit(text11, [30, 370])
             self.game_display.blit(text12, [100, 400])
             self.game_display.blit(text13, [110, 430])
-        text = font.render("Press p to play", True, WHITE)
+        text = render_text("Press p to play", 20)
         self.game_display.blit(text, [600, 550])
 
 
 if __name__ == '__main__':
-    intro = Intro()
+    parser = ArgumentParser(description='Play Tetris.')
+    parser.add_argument('--weights', help='hint heuristic weights saved by tuner.py')
+    parser.add_argument('--beam', action='store_true', help='plan hints with a beam search over several pieces')
+    parser.add_argument('--beam-width', type=int, default=16, help='boards kept per depth by --beam')
+    parser.add_argument('--beam-depth', type=int, default=6, help='pieces planned ahead by --beam')
+    parser.add_argument('--beam-budget', type=float, default=100, help='time limit of one --beam search in ms')
+    parser.add_argument('--drop-hints', action='store_true',
+                        help='only hint straight hard drops instead of every reachable placement')
+    parser.add_argument('--seed', type=replay_seed, help='seed of the piece stream, 0 to 2**64 - 1')
+    parser.add_argument('--seven-bag', action='store_true', help='deal pieces from shuffled bags of seven')
+    parser.add_argument('--record', help='record each game to a replay file, the first game to this path and '
+                                         'later ones to NAME-2.EXT, NAME-3.EXT, ...')
+    parser.add_argument('--replay', help='play back a replay file instead of starting the menu')
+    parser.add_argument('--speed', type=playback_speed, default=1.0, help='playback speed of --replay, above 0')
+    parser.add_argument('--das', type=float, default=167, help='delayed auto-shift of held keys in ms')
+    parser.add_argument('--arr', type=float, default=33, help='auto-repeat interval of held keys in ms')
+    parser.add_argument('--latency-log', help='write key press to move latencies to this CSV file')
+    parser.add_argument('--render-cap', type=int, default=FPS, help='maximum frames drawn per second, 0 for no cap')
+    parser.add_argument('--profile', help='time each frame phase and write PROFILE.csv and PROFILE.json at game end')
+    parser.add_argument('--profile-overlay', action='store_true', help='show frame phase percentiles on screen')
+    parser.add_argument('--connect', metavar='HOST:PORT', help='play a networked versus match on this server')
+    parser.add_argument('--match', default='', help='match key, clients with the same key play each other')
+    args = parser.parse_args()
+    if args.connect:
+        host, port = args.connect.rsplit(':', 1)
+        client = Client()
+        client.start_thread(host, int(port), args.match.encode())
+        settings = Settings()
+        settings.game_version = 2
+        NetworkGame(start_display(), settings, client).run()
+    if args.replay:
+        replay = Replay.load(args.replay)
+        game_class = ReplayGameFor2 if replay.versus else ReplayGame
+        game_class(start_display(), replay, args.speed).run()
+    settings = Settings()
+    settings.seed = args.seed
+    settings.seven_bag = args.seven_bag
+    settings.record_path = args.record
+    settings.render_cap = args.render_cap
+    settings.das = args.das / 1000
+    settings.arr = args.arr / 1000
+    settings.latency_path = args.latency_log
+    settings.profile_path = args.profile
+    settings.profile_overlay = args.profile_overlay
+    settings.hint_reachable = not args.drop_hints
+    settings.hint_beam = args.beam
+    settings.hint_beam_width = args.beam_width
+    settings.hint_beam_depth = args.beam_depth
+    settings.hint_beam_budget = args.beam_budget / 1000
+    if args.weights:
+        settings.hint_weights = ai.load_weights(args.weights)
+    intro = Intro(settings=settings)
     intro.run()
@@ -0,0 +1,433 @@
+from argparse import ArgumentParser
+import asyncio
+import random
+import struct
+import threading
+import time
+
+import numpy as np
+
+from engine import (BOARD_HEIGHT, BOARD_WIDTH, EMPTY, KINDS, Action, Player, Settings, Tetromino, VersusSimulation,
+                    column_profile)
+
+HELLO = b'H'
+START = b'S'
+INPUT = b'I'
+UPDATE = b'U'
+END = b'E'
+RIGHT = 0
+LEFT = 1
+
+LENGTH = struct.Struct('<H')
+START_MESSAGE = struct.Struct('<cBQB')
+UPDATE_HEADER = struct.Struct('<cIB')
+BOARD_HEADER = struct.Struct('<BIBBbbH')
+END_MESSAGE = struct.Struct('<cHH')
+KIND_INDEX = {kind: index for index, kind in enumerate(KINDS)}
+COLUMN_BITS = 1 << np.arange(BOARD_WIDTH)
+PACKED_ROW = BOARD_WIDTH // 2
+FULL_GRID_BYTES = BOARD_HEIGHT * BOARD_WIDTH
+MAX_BUFFERED = 1 << 16
+
+
+def frame(payload):
+    return LENGTH.pack(len(payload)) + payload
+
+
+async def read_message(reader):
+    size, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    return await reader.readexactly(size)
+
+
+def encode_board(player, exists, sent, board_changed=True):
+    grid = player.block_grid
+    if board_changed:
+        changed = np.flatnonzero((grid != sent).any(axis=1))
+        sent[changed] = grid[changed]
+    else:
+        changed = np.zeros(0, dtype=np.int64)
+    mask = int(np.bitwise_or.reduce(1 << changed)) if len(changed) else 0
+    packed = grid[changed, 0::2] | grid[changed, 1::2] << 4
+    tet = player.tetromino
+    return BOARD_HEADER.pack(exists, mask, KIND_INDEX[tet.kind], tet.rotation, tet.pos[0], tet.pos[1],
+                             player.lines_cleared) + packed.tobytes()
+
+
+def decode_board(player, data, offset):
+    exists, mask, kind, rotation, x, y, lines = BOARD_HEADER.unpack_from(data, offset)
+    offset += BOARD_HEADER.size
+    changed = [row for row in range(BOARD_HEIGHT) if mask >> row & 1]
+    if changed:
+        packed = np.frombuffer(data, np.uint8, len(changed) * PACKED_ROW, offset).reshape(-1, PACKED_ROW)
+        offset += packed.size
+        player.block_grid[changed, 0::2] = packed & 15
+        player.block_grid[changed, 1::2] = packed >> 4
+        occupied = (player.block_grid[changed] != EMPTY) @ COLUMN_BITS
+        for row, bits in zip(changed, occupied.tolist()):
+            player.rows[row] = bits
+        player.heights, player.holes = column_profile(player.rows)
+        player.board_version += 1
+    player.tetromino = Tetromino(KINDS[kind], rotation, (x, y))
+    player.lines_cleared = lines
+    return bool(exists), offset
+
+
+class Match:
+    def __init__(self, connections, settings=None, seed=None):
+        self.simulation = VersusSimulation(settings, seed)
+        self.connections = connections
+        self.sent = [np.full((BOARD_HEIGHT, BOARD_WIDTH), EMPTY, dtype=np.uint8) for _ in range(2)]
+        self.keys = [None, None]
+        self.next_kind = None
+        self.finished = False
+        self.bytes_sent = 0
+        difficulty = self.simulation.settings.difficulty.value
+        for side, connection in enumerate(connections):
+            connection.match = self
+            connection.side = side
+            self.send(connection, START_MESSAGE.pack(START, side, self.simulation.seed, difficulty))
+
+    def boards(self):
+        simulation = self.simulation
+        return ((simulation.player, simulation.right_exists), (simulation.player_left, simulation.left_exists))
+
+    def apply(self, side, action):
+        if not self.finished:
+            self.simulation.step(action, left=side == LEFT)
+
+    def advance(self):
+        simulation = self.simulation
+        simulation.tick()
+        flags = 0
+        records = []
+        for side, (player, exists) in enumerate(self.boards()):
+            key = (player.board_version, player.tetromino.state, exists, player.lines_cleared)
+            previous = self.keys[side]
+            if key != previous:
+                board_changed = previous is None or key[0] != previous[0]
+                records.append(encode_board(player, exists, self.sent[side], board_changed))
+                self.keys[side] = key
+                flags |= 1 << side
+        if simulation.next_tetromino.kind != self.next_kind:
+            self.next_kind = simulation.next_tetromino.kind
+            flags |= 4
+            records.append(bytes((KIND_INDEX[self.next_kind],)))
+        if flags:
+            self.broadcast(UPDATE_HEADER.pack(UPDATE, simulation.count, flags) + b''.join(records))
+        if simulation.game_over:
+            self.finish()
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        simulation = self.simulation
+        self.broadcast(END_MESSAGE.pack(END, simulation.player.lines_cleared, simulation.player_left.lines_cleared))
+        for connection in self.connections:
+            connection.close()
+
+    def broadcast(self, payload):
+        message = frame(payload)
+        for connection in self.connections:
+            self.send(connection, message, framed=True)
+
+    def send(self, connection, payload, framed=False):
+        message = payload if framed else frame(payload)
+        if connection.write(message):
+            self.bytes_sent += len(message)
+
+
+class Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.key = None
+        self.match = None
+        self.side = None
+
+    def write(self, message):
+        if self.writer.is_closing():
+            return False
+        if self.writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+            self.close()
+            return False
+        self.writer.write(message)
+        return True
+
+    def close(self):
+        if not self.writer.is_closing():
+            self.writer.close()
+
+
+class Server:
+    def __init__(self, settings=None, tick_rate=60):
+        self.settings = settings
+        self.tick_rate = tick_rate
+        self.waiting = {}
+        self.matches = []
+        self.finished_matches = 0
+        self.ticks = 0
+        self.match_ticks = 0
+        self.tick_time = 0.0
+        self.late_ticks = 0
+        self.inputs = 0
+        self.bytes_sent = 0
+        self.handlers = {}
+
+    async def handle(self, reader, writer):
+        connection = Connection(reader, writer)
+        self.handlers[asyncio.current_task()] = connection
+        try:
+            hello = await read_message(reader)
+            if hello[:1] != HELLO:
+                return
+            connection.key = hello[1:]
+            opponent = self.waiting.pop(connection.key, None)
+            if opponent is None or opponent.writer.is_closing():
+                self.waiting[connection.key] = connection
+            else:
+                self.matches.append(Match([opponent, connection], self.settings))
+            while True:
+                message = await read_message(reader)
+                if message[:1] == INPUT and connection.match is not None and len(message) == 2:
+                    self.inputs += 1
+                    try:
+                        action = Action(message[1])
+                    except ValueError:
+                        continue
+                    connection.match.apply(connection.side, action)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self.handlers[asyncio.current_task()]
+            if self.waiting.get(connection.key) is connection:
+                del self.waiting[connection.key]
+            if connection.match is not None:
+                connection.match.finish()
+            connection.close()
+
+    async def close_connections(self):
+        handlers = list(self.handlers.items())
+        for _, connection in handlers:
+            connection.close()
+        await asyncio.gather(*(handler for handler, _ in handlers), return_exceptions=True)
+
+    async def tick_loop(self):
+        loop = asyncio.get_running_loop()
+        step = 1 / self.tick_rate
+        due = loop.time()
+        while True:
+            start = time.perf_counter()
+            for match in self.matches:
+                match.advance()
+                self.match_ticks += 1
+            if any(match.finished for match in self.matches):
+                for match in self.matches:
+                    if match.finished:
+                        self.bytes_sent += match.bytes_sent
+                        self.finished_matches += 1
+                self.matches = [match for match in self.matches if not match.finished]
+            self.tick_time += time.perf_counter() - start
+            self.ticks += 1
+            due += step
+            delay = due - loop.time()
+            if delay < 0:
+                self.late_ticks += 1
+                due = loop.time()
+            await asyncio.sleep(max(delay, 0))
+
+    def total_bytes_sent(self):
+        return self.bytes_sent + sum(match.bytes_sent for match in self.matches)
+
+    async def serve(self, host='127.0.0.1', port=7777):
+        server = await asyncio.start_server(self.handle, host, port)
+        ticker = asyncio.create_task(self.tick_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            ticker.cancel()
+            await self.close_connections()
+
+
+class Client:
+    def __init__(self, create_player=None):
+        create_player = Player if create_player is None else create_player
+        self.player = create_player(Tetromino(KINDS[0]))
+        self.player_left = create_player(Tetromino(KINDS[0]))
+        self.right_exists = False
+        self.left_exists = False
+        self.next_tetromino = Tetromino(KINDS[0])
+        self.side = None
+        self.seed = None
+        self.frame = 0
+        self.started = asyncio.Event()
+        self.finished = False
+        self.result = None
+        self.writer = None
+        self.loop = None
+        self.bytes_received = 0
+
+    async def connect(self, host='127.0.0.1', port=7777, key=b''):
+        self.loop = asyncio.get_running_loop()
+        reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.write(frame(HELLO + key))
+        return asyncio.create_task(self.receive(reader))
+
+    async def receive(self, reader):
+        try:
+            while True:
+                message = await read_message(reader)
+                self.bytes_received += len(message) + LENGTH.size
+                self.handle(message)
+                if self.finished:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.finished = True
+            self.started.set()
+            self.writer.close()
+
+    def handle(self, message):
+        kind = message[:1]
+        if kind == START:
+            _, self.side, self.seed, _ = START_MESSAGE.unpack(message)
+            self.started.set()
+        elif kind == UPDATE:
+            _, self.frame, flags = UPDATE_HEADER.unpack_from(message)
+            offset = UPDATE_HEADER.size
+            if flags & 1:
+                self.right_exists, offset = decode_board(self.player, message, offset)
+            if flags & 2:
+                self.left_exists, offset = decode_board(self.player_left, message, offset)
+            if flags & 4:
+                self.next_tetromino = Tetromino(KINDS[message[offset]])
+        elif kind == END:
+            _, right, left = END_MESSAGE.unpack(message)
+            self.result = (right, left)
+            self.finished = True
+
+    def send_input(self, action):
+        if self.writer is None or self.finished:
+            return
+        self.loop.call_soon_threadsafe(self.writer.write, frame(INPUT + bytes((action.value,))))
+
+    def start_thread(self, host='127.0.0.1', port=7777, key=b''):
+        ready = threading.Event()
+
+        def run():
+            async def main():
+                task = await self.connect(host, port, key)
+                ready.set()
+                await task
+            asyncio.run(main())
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        ready.wait()
+        return thread
+
+
+async def play_random(client, rng, input_rate):
+    actions = (Action.LEFT, Action.RIGHT, Action.ROTATE, Action.DOWN, Action.DROP)
+    await client.started.wait()
+    while not client.finished:
+        await asyncio.sleep(rng.expovariate(input_rate))
+        client.send_input(rng.choices(actions, (3, 3, 2, 2, 1))[0])
+
+
+async def run_bot(host, port, key, rng, input_rate, deadline, stats):
+    while time.perf_counter() < deadline:
+        client = Client()
+        try:
+            receiver = await client.connect(host, port, key)
+        except ConnectionError:
+            return
+        player = asyncio.create_task(play_random(client, rng, input_rate))
+        remaining = deadline - time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(receiver), max(remaining, 0))
+        except asyncio.TimeoutError:
+            client.writer.close()
+            await receiver
+        player.cancel()
+        await asyncio.gather(player, return_exceptions=True)
+        stats['bytes_received'] += client.bytes_received
+
+
+async def load_test(matches=200, seconds=10.0, input_rate=8.0, tick_rate=60, seed=0):
+    server = Server(tick_rate=tick_rate)
+    tcp = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+    port = tcp.sockets[0].getsockname()[1]
+    ticker = asyncio.create_task(server.tick_loop())
+    stats = {'bytes_received': 0}
+    deadline = time.perf_counter() + seconds
+    cpu = time.process_time()
+    start = time.perf_counter()
+    bots = [run_bot('127.0.0.1', port, str(index // 2).encode(), random.Random(seed + index), input_rate, deadline,
+                    stats)
+            for index in range(2 * matches)]
+    await asyncio.gather(*bots)
+    elapsed = time.perf_counter() - start
+    ticker.cancel()
+    await asyncio.gather(ticker, return_exceptions=True)
+    tcp.close()
+    await server.close_connections()
+    await tcp.wait_closed()
+    match_seconds = server.match_ticks / tick_rate
+    return {
+        'matches': matches,
+        'elapsed': elapsed,
+        'ticks_per_second': server.ticks / elapsed,
+        'late_ticks': server.late_ticks,
+        'finished_matches': server.finished_matches,
+        'inputs_per_second': server.inputs / elapsed,
+        'server_tick_us_per_match': server.tick_time / server.match_ticks * 1e6 if server.match_ticks else 0.0,
+        'server_load': server.tick_time / elapsed,
+        'process_load': (time.process_time() - cpu) / elapsed,
+        'bytes_per_match_second': server.total_bytes_sent() / match_seconds if match_seconds else 0.0,
+        'full_grid_bytes_per_match_second': 2 * 2 * FULL_GRID_BYTES * tick_rate
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Networked versus Tetris: authoritative server, bots and a load test.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='host matches, pairing clients that send the same key')
+    serve.add_argument('--host', default='0.0.0.0')
+    serve.add_argument('--port', type=int, default=7777)
+    serve.add_argument('--tick-rate', type=int, default=60)
+    bot = commands.add_parser('bot', help='connect a headless client that presses random keys')
+    bot.add_argument('--host', default='127.0.0.1')
+    bot.add_argument('--port', type=int, default=7777)
+    bot.add_argument('--key', default='')
+    bot.add_argument('--rate', type=float, default=8.0, help='inputs per second')
+    bot.add_argument('--seconds', type=float, default=60.0)
+    load = commands.add_parser('loadtest', help='run many loopback matches in one process')
+    load.add_argument('--matches', type=int, default=200)
+    load.add_argument('--seconds', type=float, default=10.0)
+    load.add_argument('--rate', type=float, default=8.0, help='inputs per second per client')
+    load.add_argument('--tick-rate', type=int, default=60)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        asyncio.run(Server(Settings(), args.tick_rate).serve(args.host, args.port))
+    elif args.command == 'bot':
+        stats = {'bytes_received': 0}
+        asyncio.run(run_bot(args.host, args.port, args.key.encode(), random.Random(), args.rate,
+                            time.perf_counter() + args.seconds, stats))
+        print(f"received {stats['bytes_received']} bytes")
+    else:
+        result = asyncio.run(load_test(args.matches, args.seconds, args.rate, args.tick_rate))
+        print(f"{result['matches']} matches for {result['elapsed']:.1f}s: {result['ticks_per_second']:.1f} ticks/s "
+              f"({result['late_ticks']} late), {result['finished_matches']} matches finished, "
+              f"{result['inputs_per_second']:.0f} inputs/s")
+        print(f"server tick {result['server_tick_us_per_match']:.1f} us per match, server load "
+              f"{result['server_load']:.0%}, process load {result['process_load']:.0%} (clients included)")
+        print(f"{result['bytes_per_match_second']:.0f} bytes/s per match vs "
+              f"{result['full_grid_bytes_per_match_second']} for full grids every tick")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+from collections import deque
+from contextlib import nullcontext
+import csv
+import json
+import time
+
+import numpy as np
+
+PHASES = ('events', 'gravity', 'line_clear', 'hint', 'draw')
+PERCENTILES = (50, 95, 99)
+NULL_PHASE = nullcontext()
+
+
+class Phase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.stack.append([self.name, time.perf_counter(), 0.0])
+
+    def __exit__(self, *exc_info):
+        name, start, children = self.profiler.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.profiler.current[name] += elapsed - children
+        if self.profiler.stack:
+            self.profiler.stack[-1][2] += elapsed
+
+
+class FrameProfiler:
+    def __init__(self, enabled=True, window=600):
+        self.enabled = enabled
+        self.phases = {name: Phase(self, name) for name in PHASES}
+        self.samples = {name: deque(maxlen=window) for name in PHASES + ('frame',)}
+        self.frames = []
+        self.stack = []
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.frame_start = None
+        self.skipped = False
+
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_PHASE
+        return self.phases[name]
+
+    def start_frame(self):
+        if not self.enabled:
+            return
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.frame_start = time.perf_counter()
+        self.skipped = False
+
+    def skip_frame(self):
+        self.skipped = True
+
+    def end_frame(self):
+        if not self.enabled or self.frame_start is None or self.skipped:
+            return
+        total = time.perf_counter() - self.frame_start
+        for name in PHASES:
+            self.samples[name].append(self.current[name])
+        self.samples['frame'].append(total)
+        self.frames.append(tuple(self.current[name] for name in PHASES) + (total,))
+
+    def percentiles(self):
+        return {name: dict(zip(PERCENTILES, np.percentile(samples, PERCENTILES).tolist() if samples else
+                               [0.0] * len(PERCENTILES)))
+                for name, samples in self.samples.items()}
+
+    def summary(self):
+        frames = np.array(self.frames).reshape(-1, len(PHASES) + 1)
+        summary = {}
+        for index, name in enumerate(PHASES + ('frame',)):
+            column = frames[:, index] * 1000
+            summary[name] = {
+                'mean_ms': float(column.mean()) if len(column) else 0.0,
+                'max_ms': float(column.max()) if len(column) else 0.0
+            }
+            for percentile in PERCENTILES:
+                summary[name][f'p{percentile}_ms'] = float(np.percentile(column, percentile)) if len(column) else 0.0
+        return {'frames': len(self.frames), 'phases': summary}
+
+    def dump(self, prefix):
+        with open(prefix + '.csv', 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(('frame',) + tuple(f'{name}_ms' for name in PHASES) + ('total_ms',))
+            for index, frame in enumerate(self.frames):
+                writer.writerow((index,) + tuple(f'{value * 1000:.4f}' for value in frame))
+        with open(prefix + '.json', 'w') as file:
+            json.dump(self.summary(), file, indent=2)
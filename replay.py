@@ -0,0 +1,183 @@
+from argparse import ArgumentParser, ArgumentTypeError
+import os
+import struct
+import time
+
+from engine import Action, Difficulty, Settings, Simulation, VersusSimulation
+
+MAGIC = b'TRPL'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBQ')
+SEVEN_BAG = 1
+VERSUS = 2
+LEFT = 8
+
+
+def write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append(value & 0x7f | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class Replay:
+    def __init__(self, seed, difficulty=Difficulty.MEDIUM, seven_bag=False, versus=False, events=None, frames=0):
+        self.seed = seed
+        self.difficulty = difficulty
+        self.seven_bag = seven_bag
+        self.versus = versus
+        self.events = [] if events is None else events
+        self.frames = frames
+
+    def settings(self):
+        settings = Settings()
+        settings.game_version = 2 if self.versus else 1
+        settings.difficulty = self.difficulty
+        settings.seed = self.seed
+        settings.seven_bag = self.seven_bag
+        return settings
+
+    def simulation(self):
+        if self.versus:
+            return VersusSimulation(self.settings())
+        return Simulation(self.settings())
+
+    def to_bytes(self):
+        flags = SEVEN_BAG * self.seven_bag | VERSUS * self.versus
+        buffer = bytearray(HEADER.pack(MAGIC, VERSION, flags, self.difficulty.value, self.seed))
+        write_varint(buffer, self.frames)
+        write_varint(buffer, len(self.events))
+        previous = 0
+        for frame, code in self.events:
+            write_varint(buffer, frame - previous)
+            buffer.append(code)
+            previous = frame
+        return bytes(buffer)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, flags, difficulty, seed = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a replay file or unsupported replay version')
+        frames, offset = read_varint(data, HEADER.size)
+        count, offset = read_varint(data, offset)
+        events = []
+        frame = 0
+        for _ in range(count):
+            delta, offset = read_varint(data, offset)
+            frame += delta
+            events.append((frame, data[offset]))
+            offset += 1
+        return cls(seed, Difficulty(difficulty), bool(flags & SEVEN_BAG), bool(flags & VERSUS), events, frames)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            return cls.from_bytes(file.read())
+
+
+class Recorder:
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.replay = Replay(simulation.seed, simulation.settings.difficulty, simulation.settings.seven_bag,
+                             isinstance(simulation, VersusSimulation))
+        simulation.recorder = self
+
+    def record(self, frame, action, left=False):
+        self.replay.events.append((frame, action.value | LEFT * left))
+
+    def finish(self):
+        self.replay.frames = self.simulation.count
+        return self.replay
+
+    def save(self, path):
+        self.finish().save(path)
+
+
+def numbered_path(path, number):
+    if number == 1:
+        return path
+    stem, extension = os.path.splitext(path)
+    return f'{stem}-{number}{extension}'
+
+
+class ReplayPlayer:
+    def __init__(self, replay, simulation=None):
+        self.replay = replay
+        self.simulation = replay.simulation() if simulation is None else simulation
+        self.index = 0
+
+    @property
+    def finished(self):
+        return self.simulation.game_over or (self.simulation.count >= self.replay.frames
+                                             and self.index == len(self.replay.events))
+
+    def advance(self):
+        simulation = self.simulation
+        events = self.replay.events
+        while self.index < len(events) and events[self.index][0] <= simulation.count:
+            code = events[self.index][1]
+            if self.replay.versus:
+                simulation.step(Action(code & ~LEFT), left=bool(code & LEFT))
+            else:
+                simulation.step(Action(code))
+            self.index += 1
+        if simulation.count < self.replay.frames:
+            simulation.tick()
+
+    def run(self):
+        while not self.finished:
+            self.advance()
+        return self.simulation
+
+
+def replay_seed(text):
+    seed = int(text)
+    if not 0 <= seed < 1 << 64:
+        raise ArgumentTypeError(f'seed must be between 0 and {(1 << 64) - 1}')
+    return seed
+
+
+def playback_speed(text):
+    speed = float(text)
+    if not 0 < speed < float('inf'):
+        raise ArgumentTypeError('speed must be a finite number greater than 0')
+    return speed
+
+
+def main():
+    parser = ArgumentParser(description='Play a recorded game back headless at full speed.')
+    parser.add_argument('replay', help='replay file recorded with main.py --record')
+    args = parser.parse_args()
+    replay = Replay.load(args.replay)
+
+    start = time.perf_counter()
+    simulation = ReplayPlayer(replay).run()
+    elapsed = time.perf_counter() - start
+    print(f"seed {replay.seed}, {len(replay.events)} inputs, {replay.frames} frames "
+          f"in {elapsed:.3f}s ({replay.frames / elapsed if elapsed else 0.0:.0f} frames/s)")
+    if replay.versus:
+        print(f"left player cleared {simulation.player_left.lines_cleared} lines, "
+              f"right player cleared {simulation.player.lines_cleared} lines")
+    else:
+        print(f"cleared {simulation.player.lines_cleared} lines, topped out: {simulation.game_over}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import time
+
+
+class FixedStepScheduler:
+    def __init__(self, step_rate=60, render_cap=60, max_steps=8):
+        self.step = 1 / step_rate
+        self.render_interval = 1 / render_cap if render_cap else 0.0
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        self.last = time.perf_counter()
+        self.last_render = float('-inf')
+        self.dirty = True
+
+    def reset(self):
+        self.accumulator = 0.0
+        self.last = time.perf_counter()
+        self.dirty = True
+
+    def advance(self):
+        now = time.perf_counter()
+        self.accumulator = min(self.accumulator + now - self.last, self.max_steps * self.step)
+        self.last = now
+        steps = int(self.accumulator / self.step)
+        self.accumulator -= steps * self.step
+        return steps
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def should_render(self):
+        if not self.dirty:
+            return False
+        now = time.perf_counter()
+        if now - self.last_render < self.render_interval:
+            return False
+        self.last_render = now
+        self.dirty = False
+        return True
+
+    def step_times(self, steps):
+        due = self.last - self.accumulator
+        return [due - (steps - 1 - index) * self.step for index in range(steps)]
+
+    def delay(self):
+        now = time.perf_counter()
+        delay = self.step - self.accumulator - (now - self.last)
+        if self.dirty:
+            delay = min(delay, self.last_render + self.render_interval - now)
+        return delay
+
+    def wait(self):
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,176 @@
+from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Pool
+import json
+import os
+import random
+import time
+
+from engine import Simulation
+import ai
+
+POLICIES = ('greedy', 'lookahead', 'beam')
+CACHE_SIZE = 65536
+
+
+def play_game(seed, policy='greedy', max_pieces=None, weights=ai.DEFAULT_WEIGHTS, reachable=False,
+              beam_width=ai.BEAM_WIDTH, beam_depth=ai.BEAM_DEPTH, beam_known=False, executor=None, processes=1,
+              cache_size=CACHE_SIZE):
+    start = time.perf_counter()
+    simulation = Simulation(seed=seed)
+    sampler = random.Random(seed)
+    stats = ai.SearchStats()
+    cache = ai.EvaluationCache(cache_size) if cache_size and policy == 'lookahead' else None
+    planned_lines = 0
+    planned_pieces = 0
+    pieces = 0
+    while not simulation.game_over and (max_pieces is None or pieces < max_pieces):
+        if policy == 'beam':
+            kinds = [simulation.player.tetromino.kind, simulation.next_tetromino.kind]
+            if beam_known:
+                kinds += simulation.upcoming_kinds(beam_depth - len(kinds))
+            move, line = ai.find_beam_move(simulation.player, kinds, beam_width, beam_depth, float('inf'), stats,
+                                           weights, reachable, executor, processes, sampler.getrandbits(32))
+            if line is not None:
+                planned_lines += line.lines
+                planned_pieces += line.depth
+        elif policy == 'lookahead':
+            move = ai.find_lookahead_move(simulation.player, simulation.next_tetromino, time_budget=float('inf'),
+                                          stats=stats, cache=cache, weights=weights, reachable=reachable)
+        else:
+            search_start = time.perf_counter()
+            move = ai.find_best_move(simulation.player, cache, weights, reachable)
+            stats.record(0, time.perf_counter() - search_start)
+        if isinstance(move, ai.Placement):
+            simulation.play(move.path)
+        else:
+            simulation.place(move)
+        pieces += 1
+    return {
+        'seed': seed,
+        'lines_cleared': simulation.player.lines_cleared,
+        'pieces': pieces,
+        'topped_out': simulation.game_over,
+        'elapsed': time.perf_counter() - start,
+        'worker': os.getpid(),
+        'nodes': stats.nodes,
+        'decisions': stats.decisions,
+        'search_elapsed': stats.elapsed,
+        'cache_hits': cache.hits if cache is not None else 0,
+        'cache_lookups': cache.hits + cache.misses if cache is not None else 0,
+        'planned_lines': planned_lines,
+        'planned_pieces': planned_pieces
+    }
+
+
+def play_game_args(args):
+    return play_game(*args)
+
+
+def run_games(seeds, policy='greedy', max_pieces=None, workers=None, chunksize=1, weights=ai.DEFAULT_WEIGHTS,
+              reachable=False, beam_width=ai.BEAM_WIDTH, beam_depth=ai.BEAM_DEPTH, beam_known=False,
+              beam_processes=1, cache_size=CACHE_SIZE):
+    if beam_processes > 1:
+        with ProcessPoolExecutor(beam_processes) as executor:
+            return [play_game(seed, policy, max_pieces, weights, reachable, beam_width, beam_depth, beam_known,
+                              executor, beam_processes, cache_size) for seed in seeds]
+    jobs = [(seed, policy, max_pieces, weights, reachable, beam_width, beam_depth, beam_known, None, 1, cache_size)
+            for seed in seeds]
+    with Pool(workers) as pool:
+        return list(pool.imap_unordered(play_game_args, jobs, chunksize))
+
+
+def summarize(results, elapsed):
+    per_worker = defaultdict(lambda: {'games': 0, 'pieces': 0, 'elapsed': 0.0})
+    for result in results:
+        worker = per_worker[result['worker']]
+        worker['games'] += 1
+        worker['pieces'] += result['pieces']
+        worker['elapsed'] += result['elapsed']
+    games = len(results)
+    lines = [result['lines_cleared'] for result in results]
+    nodes = sum(result['nodes'] for result in results)
+    search_elapsed = sum(result['search_elapsed'] for result in results)
+    planned_pieces = sum(result['planned_pieces'] for result in results)
+    decisions = sum(result['decisions'] for result in results)
+    cache_lookups = sum(result['cache_lookups'] for result in results)
+    return {
+        'games': games,
+        'elapsed': elapsed,
+        'games_per_second': games / elapsed if elapsed else 0.0,
+        'pieces': sum(result['pieces'] for result in results),
+        'pieces_per_second': sum(result['pieces'] for result in results) / elapsed if elapsed else 0.0,
+        'lines_cleared': sum(lines),
+        'mean_lines_cleared': sum(lines) / games if games else 0.0,
+        'min_lines_cleared': min(lines, default=0),
+        'max_lines_cleared': max(lines, default=0),
+        'topped_out': sum(result['topped_out'] for result in results),
+        'nodes': nodes,
+        'nodes_per_second': nodes / search_elapsed if search_elapsed else 0.0,
+        'decision_ms': search_elapsed / decisions * 1000 if decisions else 0.0,
+        'cache_hit_rate': sum(result['cache_hits'] for result in results) / cache_lookups if cache_lookups else 0.0,
+        'planned_lines_per_piece': (sum(result['planned_lines'] for result in results) / planned_pieces
+                                    if planned_pieces else 0.0),
+        'workers': {
+            str(pid): dict(stats, pieces_per_second=stats['pieces'] / stats['elapsed'] if stats['elapsed'] else 0.0)
+            for pid, stats in sorted(per_worker.items())
+        }
+    }
+
+
+def print_summary(summary):
+    print(f"games: {summary['games']} in {summary['elapsed']:.2f}s "
+          f"({summary['games_per_second']:.2f} games/s, {summary['pieces_per_second']:.0f} pieces/s)")
+    print(f"pieces placed: {summary['pieces']}, topped out: {summary['topped_out']}")
+    print(f"lines cleared: {summary['lines_cleared']} total, {summary['mean_lines_cleared']:.1f} mean, "
+          f"{summary['min_lines_cleared']} min, {summary['max_lines_cleared']} max")
+    print(f"decision latency: {summary['decision_ms']:.3f} ms mean, cache hits: {summary['cache_hit_rate']:.0%}")
+    if summary['nodes']:
+        print(f"search: {summary['nodes']} nodes, {summary['nodes_per_second']:.0f} nodes/s")
+    if summary['planned_lines_per_piece']:
+        print(f"best lines: {summary['planned_lines_per_piece']:.3f} lines/piece planned, "
+              f"{summary['lines_cleared'] / summary['pieces'] if summary['pieces'] else 0.0:.3f} played")
+    for pid, stats in summary['workers'].items():
+        print(f"  worker {pid}: {stats['games']} games, {stats['pieces']} pieces, "
+              f"{stats['pieces_per_second']:.0f} pieces/s")
+
+
+def main():
+    parser = ArgumentParser(description='Run headless AI self-play games.')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game, later games count up')
+    parser.add_argument('--workers', type=int, default=None, help='process count, defaults to all cores')
+    parser.add_argument('--policy', choices=POLICIES, default='greedy')
+    parser.add_argument('--max-pieces', type=int, default=None, help='stop each game after this many pieces')
+    parser.add_argument('--chunksize', type=int, default=1)
+    parser.add_argument('--reachable', action='store_true',
+                        help='search every reachable placement, including slides and tucks, not only hard drops')
+    parser.add_argument('--beam-width', type=int, default=ai.BEAM_WIDTH, help='boards kept per depth by --policy beam')
+    parser.add_argument('--beam-depth', type=int, default=ai.BEAM_DEPTH, help='pieces planned ahead by --policy beam')
+    parser.add_argument('--beam-known', action='store_true',
+                        help='plan over the real upcoming pieces instead of sampling past the preview')
+    parser.add_argument('--beam-processes', type=int, default=1,
+                        help='expand large beams on this many processes, games then run one after another')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='run --policy lookahead without the per-game evaluation cache')
+    parser.add_argument('--weights', help='heuristic weights saved by tuner.py')
+    parser.add_argument('--json', help='write per-game results and the summary to this file')
+    args = parser.parse_args()
+    weights = ai.load_weights(args.weights) if args.weights else ai.DEFAULT_WEIGHTS
+
+    seeds = range(args.seed, args.seed + args.games)
+    start = time.perf_counter()
+    results = run_games(seeds, args.policy, args.max_pieces, args.workers, args.chunksize, weights,
+                        args.reachable, args.beam_width, args.beam_depth, args.beam_known, args.beam_processes,
+                        0 if args.no_cache else CACHE_SIZE)
+    summary = summarize(results, time.perf_counter() - start)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'summary': summary, 'games': sorted(results, key=lambda result: result['seed'])}, file,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
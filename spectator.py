@@ -0,0 +1,178 @@
+from argparse import ArgumentParser
+import math
+import time
+
+import numpy as np
+import pygame
+
+from engine import BOARD_HEIGHT, BOARD_WIDTH, COLOR_INDEX, COLOR_NAMES, Action, Simulation
+from main import BLACK, COLORS, FPS, render_text
+from profiler import FrameProfiler
+from selfplay import POLICIES
+import ai
+
+CELL_SIZE = 5
+GAP = 6
+STATUS_HEIGHT = 24
+BACKGROUND = len(COLOR_NAMES)
+
+
+class Spectator:
+    def __init__(self, count=64, seed=0, cell=CELL_SIZE, policy='greedy', input_interval=4, weights=ai.DEFAULT_WEIGHTS,
+                 reachable=True, profile=False):
+        self.count = count
+        self.cell = cell
+        self.policy = policy
+        self.input_interval = input_interval
+        self.weights = weights
+        self.reachable = reachable
+        self.next_seed = seed + count
+        self.simulations = [Simulation(seed=seed + index) for index in range(count)]
+        self.paths = [[] for _ in range(count)]
+        self.cache = ai.EvaluationCache(4096)
+        self.profiler = FrameProfiler(profile)
+        self.frame = 0
+        self.games = 0
+        self.pieces = 0
+        self.finished_lines = 0
+        self.columns = math.ceil(math.sqrt(2 * count))
+        self.rows = math.ceil(count / self.columns)
+        self.board_size = (BOARD_WIDTH * cell, BOARD_HEIGHT * cell)
+        self.tile_size = (self.board_size[0] + GAP, self.board_size[1] + GAP)
+        self.size = (self.columns * self.tile_size[0] + GAP, self.rows * self.tile_size[1] + GAP + STATUS_HEIGHT)
+        self.cells = np.full((self.rows * self.columns, BOARD_HEIGHT, BOARD_WIDTH), BACKGROUND, dtype=np.uint8)
+        self.canvas = None
+        self.boards = None
+        self.lut = None
+        self.display = None
+        self.board_area = None
+
+    def attach(self, display):
+        self.display = display
+        palette = [COLORS[name] for name in COLOR_NAMES] + [BLACK]
+        self.lut = np.array([display.map_rgb(color) for color in palette], dtype=np.uint32)
+        self.canvas = np.full((self.rows * self.tile_size[1], self.columns * self.tile_size[0]), self.lut[BACKGROUND],
+                              dtype=np.uint32)
+        self.boards = self.canvas.reshape(self.rows, self.tile_size[1], self.columns,
+                                          self.tile_size[0])[:, :self.board_size[1], :, :self.board_size[0]]
+        self.board_area = display.subsurface(pygame.Rect(GAP, GAP, self.canvas.shape[1], self.canvas.shape[0]))
+        display.fill(BLACK)
+
+    def decide(self, simulation):
+        with self.profiler.phase('hint'):
+            if self.policy == 'beam':
+                kinds = (simulation.player.tetromino.kind, simulation.next_tetromino.kind)
+                move, _ = ai.find_beam_move(simulation.player, kinds, weights=self.weights, reachable=self.reachable)
+            elif self.policy == 'lookahead':
+                move = ai.find_lookahead_move(simulation.player, simulation.next_tetromino, time_budget=float('inf'),
+                                              cache=self.cache, weights=self.weights, reachable=self.reachable)
+            else:
+                move = ai.find_best_move(simulation.player, self.cache, self.weights, self.reachable)
+        if isinstance(move, ai.Placement):
+            return list(move.path)
+        rotation, sideways = move
+        return ([Action.ROTATE] * rotation + [Action.RIGHT if sideways > 0 else Action.LEFT] * abs(sideways)
+                + [Action.DROP])
+
+    def step(self):
+        self.frame += 1
+        for index, simulation in enumerate(self.simulations):
+            if (self.frame + index) % self.input_interval:
+                continue
+            if simulation.game_over:
+                self.games += 1
+                self.finished_lines += simulation.player.lines_cleared
+                simulation = self.simulations[index] = Simulation(seed=self.next_seed)
+                self.next_seed += 1
+                self.paths[index] = []
+            path = self.paths[index]
+            if not path:
+                path.extend(self.decide(simulation))
+            with self.profiler.phase('gravity'):
+                if path:
+                    simulation.player.apply(path.pop(0))
+                if not path:
+                    simulation.lock()
+                    self.pieces += 1
+
+    def render(self):
+        cells = self.cells
+        indices, ys, xs, colors = [], [], [], []
+        for index, simulation in enumerate(self.simulations):
+            cells[index] = simulation.player.block_grid
+            tet = simulation.player.tetromino
+            color = COLOR_INDEX[tet.color]
+            for dx, dy in tet.squares:
+                indices.append(index)
+                xs.append(tet.pos[0] + dx)
+                ys.append(tet.pos[1] + dy)
+                colors.append(color)
+        cells[indices, ys, xs] = colors
+        pixels = self.lut[cells].repeat(self.cell, axis=1).repeat(self.cell, axis=2)
+        self.boards[...] = pixels.reshape(self.rows, self.columns, self.board_size[1],
+                                          self.board_size[0]).transpose(0, 2, 1, 3)
+        pygame.surfarray.blit_array(self.board_area, self.canvas.T)
+
+    def status_text(self, fps):
+        lines = self.finished_lines + sum(simulation.player.lines_cleared for simulation in self.simulations)
+        return (f"{self.count} boards  {fps:5.1f} fps  {self.games} games over  {self.pieces} pieces  "
+                f"{lines} lines")
+
+    def draw_status(self, fps):
+        rect = pygame.Rect(0, self.size[1] - STATUS_HEIGHT, self.size[0], STATUS_HEIGHT)
+        self.display.fill(BLACK, rect)
+        self.display.blit(render_text(self.status_text(fps), 12), [GAP, rect.y + 4])
+
+    def run(self, frames=None, fps=FPS):
+        clock = pygame.time.Clock()
+        start = time.perf_counter()
+        while frames is None or self.frame < frames:
+            self.profiler.start_frame()
+            with self.profiler.phase('events'):
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        return time.perf_counter() - start
+            self.step()
+            with self.profiler.phase('draw'):
+                self.render()
+                self.draw_status(clock.get_fps())
+                pygame.display.flip()
+            self.profiler.end_frame()
+            clock.tick(fps)
+        return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description='Watch many AI games at once.')
+    parser.add_argument('--boards', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game, later games count up')
+    parser.add_argument('--cell', type=int, default=CELL_SIZE, help='pixels per board cell')
+    parser.add_argument('--policy', choices=POLICIES, default='greedy')
+    parser.add_argument('--input-interval', type=int, default=4, help='frames between two AI inputs on a board')
+    parser.add_argument('--drop-only', action='store_true', help='only play straight hard drops')
+    parser.add_argument('--weights', help='heuristic weights saved by tuner.py')
+    parser.add_argument('--frames', type=int, help='stop after this many frames and print the frame times')
+    parser.add_argument('--fps', type=int, default=FPS, help='frame rate cap, 0 for no cap')
+    parser.add_argument('--profile', help='write PROFILE.csv and PROFILE.json with per-frame phase timings')
+    args = parser.parse_args()
+    weights = ai.load_weights(args.weights) if args.weights else ai.DEFAULT_WEIGHTS
+
+    spectator = Spectator(args.boards, args.seed, args.cell, args.policy, args.input_interval, weights,
+                          not args.drop_only, bool(args.profile or args.frames))
+    pygame.display.init()
+    pygame.display.set_caption('TETRIS spectator')
+    spectator.attach(pygame.display.set_mode(spectator.size))
+    elapsed = spectator.run(args.frames, args.fps)
+    pygame.quit()
+    if args.profile:
+        spectator.profiler.dump(args.profile)
+    if args.frames:
+        phases = spectator.profiler.summary()['phases']
+        print(f"{spectator.frame} frames in {elapsed:.2f}s, {spectator.frame / elapsed:.1f} fps")
+        for name, summary in phases.items():
+            print(f"  {name:10} mean {summary['mean_ms']:7.3f} ms  p95 {summary['p95_ms']:7.3f} ms  "
+                  f"p99 {summary['p99_ms']:7.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
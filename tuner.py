@@ -0,0 +1,116 @@
+from argparse import ArgumentParser, ArgumentTypeError
+from multiprocessing import Pool
+import json
+import os
+import time
+
+import numpy as np
+
+from selfplay import play_game_args
+import ai
+
+
+def initial_state(seed):
+    mean = np.array(ai.DEFAULT_WEIGHTS, dtype=float)
+    return {
+        'seed': seed,
+        'generation': 0,
+        'mean': mean.tolist(),
+        'std': (np.abs(mean) * 0.5 + 1).tolist(),
+        'best': {'weights': ai.DEFAULT_WEIGHTS._asdict(), 'fitness': None},
+        'history': []
+    }
+
+
+def load_checkpoint(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_checkpoint(path, state):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(state, file, indent=2)
+    os.replace(temporary, path)
+
+
+def evaluate_population(pool, population, seeds, max_pieces, policy):
+    jobs = [(seed, policy, max_pieces, ai.Weights(*weights)) for weights in population for seed in seeds]
+    results = pool.map(play_game_args, jobs)
+    lines = np.array([result['lines_cleared'] for result in results], dtype=float)
+    return lines.reshape(len(population), len(seeds)).mean(axis=1)
+
+
+def run_generation(pool, state, population_size, elite_size, games, max_pieces, policy, min_std):
+    generation = state['generation']
+    rng = np.random.default_rng([state['seed'], generation])
+    mean = np.array(state['mean'])
+    std = np.array(state['std'])
+    population = rng.normal(mean, std, size=(population_size, len(mean)))
+    population[0] = mean
+    seeds = [int(seed) for seed in rng.integers(0, 2 ** 31, size=games)]
+    fitness = evaluate_population(pool, population, seeds, max_pieces, policy)
+
+    elite = population[np.argsort(-fitness, kind='stable')[:elite_size]]
+    state['mean'] = elite.mean(axis=0).tolist()
+    state['std'] = np.maximum(elite.std(axis=0), min_std).tolist()
+    best = int(fitness.argmax())
+    if state['best']['fitness'] is None or fitness[best] > state['best']['fitness']:
+        state['best'] = {'weights': ai.Weights(*population[best].tolist())._asdict(), 'fitness': float(fitness[best])}
+    state['history'].append({
+        'generation': generation,
+        'mean_fitness': float(fitness.mean()),
+        'best_fitness': float(fitness[best]),
+        'mean_weights': state['mean']
+    })
+    state['generation'] = generation + 1
+    return fitness
+
+
+def tune(checkpoint, generations, population_size, elite_size, games, max_pieces, policy='greedy', workers=None,
+         seed=0, resume=False, min_std=0.5):
+    if resume and os.path.exists(checkpoint):
+        state = load_checkpoint(checkpoint)
+    else:
+        state = initial_state(seed)
+    with Pool(workers) as pool:
+        while state['generation'] < generations:
+            start = time.perf_counter()
+            fitness = run_generation(pool, state, population_size, elite_size, games, max_pieces, policy, min_std)
+            save_checkpoint(checkpoint, state)
+            elapsed = time.perf_counter() - start
+            print(f"generation {state['generation'] - 1}: best {fitness.max():.1f}, mean {fitness.mean():.1f} lines "
+                  f"({population_size * games / elapsed:.1f} games/s)")
+    return state
+
+
+def generation_count(text):
+    generations = int(text)
+    if generations < 1:
+        raise ArgumentTypeError('generations must be at least 1')
+    return generations
+
+
+def main():
+    parser = ArgumentParser(description='Tune Calculator weights with the cross-entropy method over self-play games.')
+    parser.add_argument('checkpoint', help='JSON checkpoint, loadable with main.py --weights')
+    parser.add_argument('--generations', type=generation_count, default=20)
+    parser.add_argument('--population', type=int, default=32)
+    parser.add_argument('--elite', type=int, default=8)
+    parser.add_argument('--games', type=int, default=8, help='seeded games per candidate, shared by the population')
+    parser.add_argument('--max-pieces', type=int, default=500)
+    parser.add_argument('--policy', choices=('greedy', 'lookahead'), default='greedy')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--resume', action='store_true', help='continue from the checkpoint if it exists')
+    args = parser.parse_args()
+
+    state = tune(args.checkpoint, args.generations, args.population, args.elite, args.games, args.max_pieces,
+                 args.policy, args.workers, args.seed, args.resume)
+    fitness = state['best']['fitness']
+    print(f"best weights: {state['best']['weights']} "
+          f"({'not evaluated' if fitness is None else f'{fitness:.1f} lines'})")
+
+
+if __name__ == '__main__':
+    main()